@@ -0,0 +1,398 @@
+"""
+Benchmark offline de creación.py: levanta un sustituto local de /api/generate,
+genera un corpus sintético de documentos .md y mide run() con distintas
+combinaciones de workers, streaming y cache. No necesita red ni un LLM real.
+
+    python benchmark.py --files 20 --h3 6 --workers 1 4 8 --stream no yes --cache cold warm
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import itertools
+import json
+import logging
+import multiprocessing
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import tracemalloc
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import List, Tuple
+
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+GENERATOR = SCRIPT_DIR / "creación.py"
+
+WORDS = (
+    "modelo prompt contexto token inferencia dataset evaluación latencia memoria "
+    "embedding vector agente función prueba código refactor error patrón api"
+).split()
+
+
+# ---------------------------------------------------------------------------
+# Servidor Ollama falso
+# ---------------------------------------------------------------------------
+
+@dataclass
+class MockConfig:
+    latency: float = 0.05  # segundos hasta el primer token
+    tps: float = 400.0  # tokens generados por segundo
+    prompt_tps: float = 4000.0  # tokens de prompt evaluados por segundo
+    tokens: int = 300  # tokens por respuesta
+    fail_rate: float = 0.0  # probabilidad de HTTP 500 (o corte a mitad en streaming)
+    seed: int = 1234
+
+
+class MockOllama:
+    """
+    Sustituto mínimo de /api/generate. Simula la latencia de prompt-eval
+    (con una cache de prefijo por "slot", como hace el servidor real), el
+    ritmo de generación y fallos aleatorios. Respeta `stream` del payload.
+    """
+
+    def __init__(self, cfg: MockConfig, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.cfg = cfg
+        self.rng = random.Random(cfg.seed)
+        self.lock = threading.Lock()
+        self.slots: List[str] = []
+        self.requests = 0
+        self.failures = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api/generate"
+
+    def __enter__(self) -> "MockOllama":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _prompt_tokens(self, prompt: str) -> int:
+        # ~4 caracteres por token; se descuenta el prefijo ya evaluado en algún slot
+        with self.lock:
+            best = 0
+            for prev in self.slots:
+                n = 0
+                for a, b in zip(prev, prompt):
+                    if a != b:
+                        break
+                    n += 1
+                best = max(best, n)
+            self.slots = (self.slots + [prompt])[-4:]
+        return max(1, (len(prompt) - best) // 4)
+
+    def _should_fail(self) -> bool:
+        with self.lock:
+            self.requests += 1
+            fail = self.rng.random() < self.cfg.fail_rate
+            self.failures += int(fail)
+        return fail
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def _send_json(self, code: int, data: dict) -> None:
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _chunk(self, data: dict) -> None:
+                line = (json.dumps(data) + "\n").encode("utf-8")
+                self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                self.wfile.flush()
+
+            def do_POST(self) -> None:
+                if self.path.rstrip("/") != "/api/generate":
+                    self._send_json(404, {"error": "not found"})
+                    return
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                cfg = mock.cfg
+                fail = mock._should_fail()
+                prompt_tokens = mock._prompt_tokens(payload.get("prompt", ""))
+                prompt_s = prompt_tokens / cfg.prompt_tps
+                time.sleep(cfg.latency + prompt_s)
+
+                words = [WORDS[(i * 7 + prompt_tokens) % len(WORDS)] for i in range(cfg.tokens)]
+                eval_s = cfg.tokens / cfg.tps
+                final = {
+                    "model": payload.get("model", ""),
+                    "done": True,
+                    "prompt_eval_count": prompt_tokens,
+                    "prompt_eval_duration": int(prompt_s * 1e9),
+                    "eval_count": cfg.tokens,
+                    "eval_duration": int(eval_s * 1e9),
+                    "total_duration": int((cfg.latency + prompt_s + eval_s) * 1e9),
+                }
+
+                if not payload.get("stream", True):
+                    if fail:
+                        self._send_json(500, {"error": "fallo simulado"})
+                        return
+                    time.sleep(eval_s)
+                    self._send_json(200, {**final, "response": " ".join(words)})
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                # Se agrupan tokens en trozos de ~20 ms para no saturar el socket
+                per_chunk = max(1, int(cfg.tps * 0.02))
+                cut_at = len(words) // 2 if fail else None
+                for i in range(0, len(words), per_chunk):
+                    if cut_at is not None and i >= cut_at:
+                        self.close_connection = True
+                        return
+                    piece = " ".join(words[i:i + per_chunk]) + " "
+                    time.sleep(len(words[i:i + per_chunk]) / cfg.tps)
+                    self._chunk({"response": piece, "done": False})
+                self._chunk({**final, "response": ""})
+                self.wfile.write(b"0\r\n\r\n")
+
+        return Handler
+
+
+# ---------------------------------------------------------------------------
+# Corpus sintético
+# ---------------------------------------------------------------------------
+
+def paragraph(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def make_corpus(docs_dir: Path, files: int, h2_per_file: int, h3_per_h2: int, words: int, seed: int) -> int:
+    rng = random.Random(seed)
+    docs_dir.mkdir(parents=True, exist_ok=True)
+    total = 0
+    for f in range(1, files + 1):
+        lines = [f"# Documento {f}", paragraph(rng, words), ""]
+        for s in range(1, h2_per_file + 1):
+            lines += [f"## Parte {f}.{s}", paragraph(rng, words), ""]
+            for t in range(1, h3_per_h2 + 1):
+                lines += [f"### {s}.{t} Tema {rng.choice(WORDS)} {f}-{s}-{t}", paragraph(rng, words), ""]
+                total += 1
+        (docs_dir / f"doc_{f:04d}.md").write_text("\n".join(lines), encoding="utf-8")
+    return total
+
+
+# ---------------------------------------------------------------------------
+# Ejecución
+# ---------------------------------------------------------------------------
+
+def load_generator():
+    spec = importlib.util.spec_from_file_location("bloggen_bench", GENERATOR)
+    mod = importlib.util.module_from_spec(spec)
+    assert spec.loader is not None
+    sys.modules[spec.name] = mod  # dataclasses necesita el módulo registrado
+    spec.loader.exec_module(mod)
+    return mod
+
+
+@dataclass
+class Result:
+    workers: int
+    stream: bool
+    cache: str
+    articles: int
+    wall_s: float
+    articles_per_s: float
+    cpu_s: float
+    peak_py_mb: float
+    peak_rss_mb: float
+    requests: int = 0  # los cuenta el mock, en el proceso padre
+    failures: int = 0
+
+
+def prepare_run(gen, work: Path, cache: str) -> Tuple[Path, Path]:
+    db_path = work / "blog.sqlite"
+    cache_db = work / "cache" / "articulos.sqlite"
+    db_path.unlink(missing_ok=True)
+    if cache == "cold":
+        shutil.rmtree(cache_db.parent, ignore_errors=True)
+    return db_path, cache_db
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss está en KB en Linux (y en bytes en macOS)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1e6 if sys.platform == "darwin" else rss / 1024
+
+
+def call_run(gen, url: str, docs_dir: Path, db_path: Path, cache_db: Path, workers: int, stream: bool) -> None:
+    gen.run(
+        docs_dir=docs_dir,
+        db_path=db_path,
+        model="mock",
+        ollama_url=url,
+        max_context_chars=gen.MAX_CONTEXT_CHARS,
+        workers=workers,
+        stream=stream,
+        cache_db=cache_db,
+        report_path=None,
+    )
+
+
+def bench_once(
+    gen, url: str, docs_dir: Path, work: Path, workers: int, stream: bool, cache: str, py_mem: bool = True,
+) -> Result:
+    db_path, cache_db = prepare_run(gen, work, cache)
+    cpu0 = time.process_time()
+    t0 = time.perf_counter()
+    call_run(gen, url, docs_dir, db_path, cache_db, workers, stream)
+    wall = time.perf_counter() - t0
+    cpu = time.process_time() - cpu0
+    rss = max_rss_mb()
+
+    with gen.sqlite3.connect(db_path) as conn:
+        articles = conn.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+    # tracemalloc ralentiza cada asignación: el pico de memoria Python se mide en
+    # una segunda pasada igual, fuera del tiempo de pared y de CPU
+    peak = 0
+    if py_mem:
+        db_path, cache_db = prepare_run(gen, work, cache)
+        tracemalloc.start()
+        call_run(gen, url, docs_dir, db_path, cache_db, workers, stream)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return Result(
+        workers=workers,
+        stream=stream,
+        cache=cache,
+        articles=articles,
+        wall_s=round(wall, 3),
+        articles_per_s=round(articles / wall, 2) if wall else 0.0,
+        cpu_s=round(cpu, 3),
+        peak_py_mb=round(peak / 1e6, 2),
+        peak_rss_mb=round(rss, 1),
+    )
+
+
+def run_combo(spec: dict, out) -> None:
+    """
+    Una combinación en su propio proceso, con el mock fuera: process_time y
+    ru_maxrss son solo de creación.py y el pico no se hereda de la anterior.
+    """
+    try:
+        gen = load_generator()
+        gen.SLEEP_BETWEEN_CALLS = spec["sleep"]
+        logging.getLogger("bloggen").setLevel(logging.WARNING)
+        res = bench_once(
+            gen, spec["url"], Path(spec["docs"]), Path(spec["work"]),
+            spec["workers"], spec["stream"], spec["cache"], py_mem=spec["py_mem"],
+        )
+        out.put(asdict(res))
+    except BaseException:
+        out.put({"error": traceback.format_exc()})
+
+
+def run_child(ctx, spec: dict) -> dict:
+    out = ctx.Queue()
+    proc = ctx.Process(target=run_combo, args=(spec, out))
+    proc.start()
+    data = out.get()
+    proc.join()
+    if "error" in data:
+        raise RuntimeError(f"workers={spec['workers']} stream={spec['stream']} cache={spec['cache']} falló:\n"
+                           f"{data['error']}")
+    return data
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark offline de creación.py con un Ollama simulado.")
+    parser.add_argument("--files", type=int, default=10, help="Documentos .md sintéticos")
+    parser.add_argument("--h2", type=int, default=3, help="H2 por documento")
+    parser.add_argument("--h3", type=int, default=4, help="H3 por H2 (densidad de artículos)")
+    parser.add_argument("--words", type=int, default=80, help="Palabras por párrafo")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4], help="Valores de --workers a probar")
+    parser.add_argument("--stream", choices=["no", "yes"], nargs="+", default=["no"], help="Modo streaming")
+    parser.add_argument("--cache", choices=["cold", "warm"], nargs="+", default=["cold"],
+                        help="cold = cache vacía; warm = cache llena, solo cache→db")
+    parser.add_argument("--latency", type=float, default=MockConfig.latency, help="Segundos hasta el primer token")
+    parser.add_argument("--tps", type=float, default=MockConfig.tps, help="Tokens/s de generación simulada")
+    parser.add_argument("--prompt-tps", type=float, default=MockConfig.prompt_tps, help="Tokens/s de prompt-eval")
+    parser.add_argument("--tokens", type=int, default=MockConfig.tokens, help="Tokens por respuesta")
+    parser.add_argument("--fail-rate", type=float, default=MockConfig.fail_rate, help="Probabilidad de fallo por petición")
+    parser.add_argument("--sleep", type=float, default=0.0, help="SLEEP_BETWEEN_CALLS durante el benchmark")
+    parser.add_argument("--seed", type=int, default=MockConfig.seed)
+    parser.add_argument(
+        "--no-py-mem", action="store_true",
+        help="No mide el pico de memoria Python (ahorra la pasada extra con tracemalloc)",
+    )
+    parser.add_argument("--json", type=str, default="", help="Guarda los resultados en este fichero JSON")
+    args = parser.parse_args()
+
+    cfg = MockConfig(
+        latency=args.latency, tps=args.tps, prompt_tps=args.prompt_tps,
+        tokens=args.tokens, fail_rate=args.fail_rate, seed=args.seed,
+    )
+    ctx = multiprocessing.get_context("spawn")
+
+    results: List[Result] = []
+    with tempfile.TemporaryDirectory(prefix="bloggen-bench-") as tmp, MockOllama(cfg) as mock:
+        work = Path(tmp)
+        docs_dir = work / "documentos"
+        n_items = make_corpus(docs_dir, args.files, args.h2, args.h3, args.words, args.seed)
+        print(f"Corpus: {args.files} documentos, {n_items} H3  |  mock: {mock.url}")
+        print(f"Mock: latencia={cfg.latency}s  {cfg.tps:.0f} tok/s  {cfg.tokens} tokens  fallos={cfg.fail_rate:.0%}")
+
+        combos: List[Tuple[int, bool, str]] = [
+            (w, s == "yes", c) for w, s, c in itertools.product(args.workers, args.stream, args.cache)
+        ]
+        base = {"url": mock.url, "docs": str(docs_dir), "work": str(work), "sleep": args.sleep}
+        for workers, stream, cache in combos:
+            spec = dict(base, workers=workers, stream=stream, cache=cache, py_mem=not args.no_py_mem)
+            if cache == "warm":
+                # Llena la cache con una pasada previa (no se mide)
+                run_child(ctx, dict(spec, cache="cold", py_mem=False))
+            req0, fail0 = mock.requests, mock.failures
+            data = run_child(ctx, spec)
+            res = Result(**dict(data, requests=mock.requests - req0, failures=mock.failures - fail0))
+            results.append(res)
+            print(
+                f"workers={res.workers:<3} stream={'sí' if res.stream else 'no':<3} cache={res.cache:<5} "
+                f"{res.articles:>5} art  {res.wall_s:>8.2f}s  {res.articles_per_s:>7.2f} art/s  "
+                f"cpu={res.cpu_s:.2f}s  rss={res.peak_rss_mb:.0f}MB  pico_py={res.peak_py_mb:.1f}MB  "
+                f"peticiones={res.requests} fallos={res.failures}"
+            )
+
+    if args.json:
+        Path(args.json).write_text(
+            json.dumps(
+                {"mock": asdict(cfg), "files": args.files, "h3": n_items,
+                 "results": [asdict(r) for r in results]},
+                ensure_ascii=False,
+                indent=2,
+            ),
+            encoding="utf-8",
+        )
+
+
+if __name__ == "__main__":
+    main()
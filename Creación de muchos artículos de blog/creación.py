@@ -1,18 +1,25 @@
 from __future__ import annotations
 
 import argparse
+import contextlib
 import hashlib
 import json
 import logging
+import math
 import re
 import sqlite3
+import threading
 import time
+import uuid
+import zlib
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Iterable, List, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 
 
 MODEL = "qwen2.5:7b-instruct-q4_0"
@@ -21,8 +28,19 @@ OLLAMA_URL = "http://127.0.0.1:11434/api/generate"
 REQUEST_TIMEOUT = 240
 RETRIES = 3
 SLEEP_BETWEEN_CALLS = 0.6
+WORKERS = 1  # peticiones simultáneas a Ollama (ajústalo a OLLAMA_NUM_PARALLEL)
+JOB_MAX_ATTEMPTS = 3  # ejecuciones que reintentan un trabajo fallido antes de dejarlo en cuarentena
+STREAM = False  # lee la respuesta token a token (NDJSON) y guarda checkpoints en la cache
+CHECKPOINT_SECONDS = 5.0  # cada cuánto se vuelca el texto parcial a la cache
+EJECT_AFTER_FAILURES = 2  # fallos seguidos para sacar un host del reparto
+EJECT_SECONDS = 60.0  # tiempo fuera del reparto (se duplica en cada expulsión, máx. 10 min)
+KEEP_ALIVE = "30m"  # mantiene el modelo (y su KV-cache del prefijo) cargado entre artículos
+
+NUM_CTX = 8192
 
 MAX_CONTEXT_CHARS = 12000  # recorta el documento para no hacer prompts gigantes
+SECTION_CONTEXT_CHARS = 4000  # texto alrededor del H3 que se manda como contexto
+OUTLINE_MAX_CHARS = 2500  # índice compacto del documento (si no cabe, solo H1/H2)
 
 
 SCRIPT_DIR = Path(__file__).resolve().parent if "__file__" in globals() else Path.cwd()
@@ -30,6 +48,10 @@ DOCS_DIR = SCRIPT_DIR / "documentos"
 DB_PATH = SCRIPT_DIR / "blog.sqlite"
 CACHE_DIR = SCRIPT_DIR / ".cache_articulos"
 CACHE_DIR.mkdir(exist_ok=True)
+CACHE_DB = CACHE_DIR / "articulos.sqlite"  # sustituye a los antiguos <hash>.json
+CACHE_MAX_MB: float | None = None  # límite de tamaño (contenido comprimido); None = sin límite
+CACHE_MAX_AGE_DAYS: float | None = None  # borra entradas no usadas en N días; None = nunca
+REPORT_PATH = SCRIPT_DIR / "runs.jsonl"  # informe por ejecución: una línea por artículo + resumen
 
 logging.basicConfig(level=logging.INFO, format="%(message)s")
 log = logging.getLogger("bloggen")
@@ -42,6 +64,15 @@ class Item:
     h1: str
     h2: str
     h3_raw: str
+    offset: int = 0  # posición del heading ### dentro del cuerpo del documento
+
+
+@dataclass(frozen=True)
+class Section:
+    level: int
+    title: str
+    start: int
+    end: int
 
 
 def now_iso() -> str:
@@ -68,46 +99,135 @@ def strip_numbering_h3(title: str) -> str:
     return t or title.strip()
 
 
+HEADING_RX = re.compile(r"^\s*(#{1,3})\s+(.+?)\s*$")
+
+
+def iter_headings(md_body: str) -> Iterable[Tuple[int, str, int]]:
+    # (nivel, texto, offset de la línea) para cada H1/H2/H3
+    pos = 0
+    for line in norm_newlines(md_body).split("\n"):
+        if m := HEADING_RX.match(line):
+            yield len(m.group(1)), m.group(2).strip(), pos
+        pos += len(line) + 1
+
+
 def extract_items(md_body: str, file_stem: str) -> List[Item]:
     h1, h2 = "", ""
     out: List[Item] = []
 
-    for line in norm_newlines(md_body).splitlines():
-        if m := re.match(r"^\s*#\s+(.+?)\s*$", line):
-            h1, h2 = m.group(1).strip(), ""
+    for level, text, pos in iter_headings(md_body):
+        if level == 1:
+            h1, h2 = text, ""
             continue
-        if m := re.match(r"^\s*##\s+(.+?)\s*$", line):
-            h2 = m.group(1).strip()
+        if level == 2:
+            h2 = text
             continue
-        if m := re.match(r"^\s*###\s+(.+?)\s*$", line):
-            raw = m.group(1).strip()
-            title = strip_numbering_h3(raw)
-            h1_use = h1.strip() or "Sin sección principal"
-            h2_use = h2.strip() or "Sin subsección"
-            cat = f"{file_stem}, {h1_use}, {h2_use}"
-            out.append(Item(title=title, category=cat, h1=h1_use, h2=h2_use, h3_raw=raw))
+        raw = text
+        title = strip_numbering_h3(raw)
+        h1_use = h1.strip() or "Sin sección principal"
+        h2_use = h2.strip() or "Sin subsección"
+        cat = f"{file_stem}, {h1_use}, {h2_use}"
+        out.append(Item(title=title, category=cat, h1=h1_use, h2=h2_use, h3_raw=raw, offset=pos))
+
+    return out
+
 
+def index_sections(md_body: str) -> List[Section]:
+    """
+    Índice H1/H2/H3 con offsets. Cada sección termina donde empieza el
+    siguiente heading de su mismo nivel o superior.
+    """
+    body = norm_newlines(md_body)
+    heads = list(iter_headings(body))
+    out: List[Section] = []
+    for i, (level, text, start) in enumerate(heads):
+        end = next((p for lv, _, p in heads[i + 1:] if lv <= level), len(body))
+        out.append(Section(level=level, title=text, start=start, end=end))
     return out
 
 
-def build_prompt(full_doc: str, category: str, article_title: str, max_chars: int) -> str:
-    # Recortamos el documento para evitar prompts enormes
-    doc = full_doc.strip()
+def build_outline(sections: List[Section], max_chars: int = OUTLINE_MAX_CHARS) -> str:
+    lines = [f"{'  ' * (sec.level - 1)}{'#' * sec.level} {sec.title}" for sec in sections]
+    outline = "\n".join(lines)
+    if len(outline) > max_chars:
+        outline = "\n".join(ln for ln, sec in zip(lines, sections) if sec.level < 3)
+    if len(outline) > max_chars:
+        outline = outline[:max_chars] + "\n[...]"
+    return outline
+
+
+def section_context(body: str, sections: List[Section], offset: int, max_chars: int) -> str:
+    """
+    Texto relevante para el H3 que empieza en `offset`: su propia sección, la
+    introducción de su H2/H1 y los H3 hermanos más cercanos, hasta `max_chars`.
+    Los fragmentos se devuelven en el orden del documento.
+    """
+    idx = next((i for i, sec in enumerate(sections) if sec.start == offset and sec.level == 3), None)
+    if idx is None:
+        doc = body.strip()
+        return doc[:max_chars] + ("\n\n[...documento recortado por longitud...]" if len(doc) > max_chars else "")
+
+    own = sections[idx]
+    h1 = next((sec for sec in reversed(sections[:idx]) if sec.level == 1), None)
+    h2 = next((sec for sec in reversed(sections[:idx]) if sec.level == 2), None)
+    if h2 is not None and h1 is not None and h2.start < h1.start:
+        h2 = None  # el H2 anterior pertenece a otro H1
+    parents = [h2, h1]
+    # H3 del mismo bloque, ordenados por cercanía al actual
+    lo = max((sec.start for sec in parents if sec is not None), default=0)
+    hi = min((sec.end for sec in parents if sec is not None), default=len(body))
+    siblings = [
+        (abs(j - idx), sec) for j, sec in enumerate(sections)
+        if sec.level == 3 and j != idx and lo <= sec.start < hi
+    ]
+    siblings.sort(key=lambda t: t[0])
+
+    spans: List[Tuple[int, int]] = [(own.start, min(own.end, own.start + max_chars))]
+    budget = max_chars - (spans[0][1] - spans[0][0])
+
+    candidates: List[Tuple[int, int]] = []
+    for parent in parents:
+        if parent is not None:
+            first_child = next((sec.start for sec in sections if sec.start > parent.start), parent.end)
+            candidates.append((parent.start, min(parent.end, first_child)))
+    candidates += [(sec.start, sec.end) for _, sec in siblings]
+
+    for start, end in candidates:
+        if end - start <= budget:
+            spans.append((start, end))
+            budget -= end - start
+
+    spans.sort()
+    parts: List[str] = []
+    last_end = -1
+    for start, end in spans:
+        if parts and start > last_end:
+            parts.append("[...]")
+        parts.append(body[start:end].strip())
+        last_end = end
+    return "\n\n".join(p for p in parts if p)
+
+
+def build_prompt(
+    doc_context: str,
+    category: str,
+    article_title: str,
+    max_chars: int,
+    outline: str = "",
+) -> str:
+    # Por si acaso, el contexto nunca supera max_chars
+    doc = doc_context.strip()
     if len(doc) > max_chars:
         doc = doc[:max_chars] + "\n\n[...documento recortado por longitud...]"
 
+    # Lo común a los H3 de un mismo documento (instrucciones + índice) va primero
+    # y en el mismo orden: así Ollama reutiliza el prefijo ya evaluado (KV-cache) y
+    # solo procesa las secciones y metadatos propios del artículo, que van al final.
     return f"""Eres un redactor técnico experto en IA aplicada a programación.
 Escribe en español, con un tono claro y práctico para programadores.
 
-CONTEXTO (documento, úsalo para alinear terminología y enfoque):
-\"\"\"{doc}\"\"\"
-
-METADATOS:
-- Categoría del artículo (contexto): {category}
-- Título del artículo: "{article_title}"
-
 TAREA:
-Escribe un artículo de blog en formato Markdown sobre el título indicado.
+Escribe un artículo de blog en formato Markdown sobre el título indicado al final.
 Longitud objetivo: 900 a 1400 palabras.
 
 Estructura mínima:
@@ -121,24 +241,141 @@ REGLAS:
 - NO incluyas front-matter YAML.
 - NO incluyas enlaces inventados.
 - Devuelve SOLO el Markdown del artículo.
-"""
 
+ÍNDICE DEL DOCUMENTO:
+{outline or "(sin índice)"}
 
-def cache_path(source_file: str, title: str, category: str) -> Path:
-    h = hashlib.sha256(f"{source_file}\n{title}\n{category}".encode("utf-8")).hexdigest()[:20]
-    return CACHE_DIR / f"{h}.json"
+CONTEXTO (secciones del documento relacionadas con el artículo, úsalo para alinear terminología y enfoque):
+\"\"\"{doc}\"\"\"
 
+METADATOS:
+- Categoría del artículo (contexto): {category}
+- Título del artículo: "{article_title}"
+"""
 
-def ollama_generate(session: requests.Session, prompt: str, model: str, url: str) -> str:
-    payload = {
+
+def cache_key(source_file: str, title: str, category: str) -> str:
+    return hashlib.sha256(f"{source_file}\n{title}\n{category}".encode("utf-8")).hexdigest()[:20]
+
+
+@dataclass
+class Host:
+    url: str
+    inflight: int = 0
+    ewma_s: float | None = None  # latencia media (exponencial) de las peticiones correctas
+    fails_in_row: int = 0
+    ejected_until: float = 0.0
+    ejections: int = 0
+    requests: int = 0
+    ok: int = 0
+    failed: int = 0
+    busy_s: float = 0.0
+    eval_count: int = 0
+
+
+class HostPool:
+    """
+    Reparte las peticiones entre varios servidores Ollama. Elige el host con
+    menor (peticiones en curso + 1) × latencia observada; los que fallan
+    EJECT_AFTER_FAILURES veces seguidas quedan fuera durante un tiempo y
+    después vuelven a probarse.
+    """
+
+    def __init__(self, urls: List[str]) -> None:
+        if not urls:
+            raise ValueError("HostPool necesita al menos una URL")
+        self.hosts = [Host(url=u) for u in urls]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.hosts)
+
+    def acquire(self) -> Host:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                live = [h for h in self.hosts if h.ejected_until <= now]
+                if live:
+                    known = [h.ewma_s for h in live if h.ewma_s is not None]
+                    # un host sin medidas se considera tan rápido como el mejor
+                    default = min(known) if known else 1.0
+                    host = min(live, key=lambda h: (h.inflight + 1) * (h.ewma_s if h.ewma_s is not None else default))
+                    host.inflight += 1
+                    host.requests += 1
+                    return host
+                wait = min(h.ejected_until for h in self.hosts) - now
+            log.info(f"    (hosts) todos expulsados, esperando {wait:.0f}s")
+            time.sleep(max(0.1, wait))
+
+    def release(self, host: Host, ok: bool, elapsed: float, eval_count: int = 0) -> None:
+        with self._lock:
+            host.inflight -= 1
+            host.busy_s += elapsed
+            if ok:
+                host.ok += 1
+                host.fails_in_row = 0
+                host.eval_count += eval_count
+                host.ewma_s = elapsed if host.ewma_s is None else 0.7 * host.ewma_s + 0.3 * elapsed
+                return
+            host.failed += 1
+            host.fails_in_row += 1
+            now = time.monotonic()
+            # Nunca se expulsa al último host vivo: solo conseguiría parar la ejecución
+            others_live = any(h is not host and h.ejected_until <= now for h in self.hosts)
+            if host.fails_in_row >= EJECT_AFTER_FAILURES and others_live:
+                pause = min(EJECT_SECONDS * 2 ** host.ejections, 600.0)
+                host.ejected_until = now + pause
+                host.ejections += 1
+                host.fails_in_row = 0
+                log.info(f"    (hosts) {host.url} expulsado {pause:.0f}s")
+
+    def summary_lines(self) -> List[str]:
+        lines = []
+        for h in self.hosts:
+            tps = h.eval_count / h.busy_s if h.busy_s else 0.0
+            lat = f"{h.ewma_s:.1f}s" if h.ewma_s is not None else "-"
+            lines.append(
+                f"  - {h.url}: {h.ok} ok / {h.failed} fallos, latencia≈{lat}, "
+                f"{tps:.1f} tok/s, expulsiones={h.ejections}"
+            )
+        return lines
+
+
+def ollama_payload(prompt: str, model: str, stream: bool, num_ctx: int = NUM_CTX) -> dict:
+    return {
         "model": model,
         "prompt": prompt,
-        "stream": False,
-        "options": {"temperature": 0.7, "top_p": 0.9, "num_ctx": 8192},
+        "stream": stream,
+        "options": {"temperature": 0.7, "top_p": 0.9, "num_ctx": num_ctx},
+        "keep_alive": KEEP_ALIVE,
     }
 
+
+STAT_FIELDS = ("prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration", "total_duration")
+
+
+def fill_stats(stats: dict | None, data: dict) -> None:
+    # Contadores que Ollama devuelve en la respuesta final (duraciones en ns)
+    if stats is not None:
+        stats.update({k: data[k] for k in STAT_FIELDS if isinstance(data.get(k), int)})
+
+
+def ollama_generate(
+    session: requests.Session,
+    prompt: str,
+    model: str,
+    hosts: HostPool,
+    stats: dict | None = None,
+    num_ctx: int = NUM_CTX,
+) -> str:
+    payload = ollama_payload(prompt, model, stream=False, num_ctx=num_ctx)
+
     last_err: Exception | None = None
+    url = ""
     for attempt in range(1, RETRIES + 1):
+        host = hosts.acquire()
+        url = host.url
+        t0 = time.perf_counter()
         try:
             r = session.post(url, json=payload, timeout=REQUEST_TIMEOUT)
             r.raise_for_status()
@@ -146,16 +383,115 @@ def ollama_generate(session: requests.Session, prompt: str, model: str, url: str
             text = (data.get("response") or "").strip()
             if not text:
                 raise RuntimeError("Respuesta vacía de Ollama (campo 'response' vacío).")
+            fill_stats(stats, data)
+            hosts.release(host, True, time.perf_counter() - t0, data.get("eval_count") or 0)
             return text
         except Exception as e:
+            hosts.release(host, False, time.perf_counter() - t0)
             last_err = e
-            # backoff simple
-            time.sleep(attempt)
+            # backoff simple (con varios hosts el siguiente intento suele ir a otro)
+            time.sleep(attempt if len(hosts) == 1 else 0)
 
     raise RuntimeError(
         f"Fallo llamando a Ollama tras {RETRIES} intentos.\n"
-        f"- URL: {url}\n"
+        f"- URL (último intento): {url}\n"
+        f"- Modelo: {model}\n"
+        f"- Último error: {last_err}"
+    )
+
+
+def continuation_prompt(prompt: str, partial: str) -> str:
+    return (
+        f"{prompt}\n"
+        "TEXTO YA ESCRITO (se cortó la conexión; continúa exactamente donde termina, "
+        "sin repetir nada y sin comentarios):\n"
+        f'\"\"\"{partial}\"\"\"\n'
+    )
+
+
+def ollama_generate_stream(
+    session: requests.Session,
+    prompt: str,
+    model: str,
+    hosts: HostPool,
+    on_partial: Callable[[str], None] | None = None,
+    partial: str = "",
+    label: str = "",
+    stats: dict | None = None,
+    num_ctx: int = NUM_CTX,
+) -> str:
+    """
+    Igual que ollama_generate pero leyendo el stream NDJSON de /api/generate.
+    Si la conexión cae a mitad, el siguiente intento continúa desde el texto
+    ya recibido en lugar de empezar de cero. `on_partial` recibe el texto
+    acumulado cada CHECKPOINT_SECONDS (y al fallar un intento).
+    """
+    last_err: Exception | None = None
+    url = ""
+    for attempt in range(1, RETRIES + 1):
+        p = continuation_prompt(prompt, partial) if partial else prompt
+        payload = ollama_payload(p, model, stream=True, num_ctx=num_ctx)
+
+        host = hosts.acquire()
+        url = host.url
+        t0 = time.perf_counter()
+        ttft: float | None = None
+        last_ckpt = t0
+        chunks: List[str] = []
+        final: dict = {}
+        try:
+            # el timeout de lectura se aplica entre fragmentos, no a la respuesta completa
+            with session.post(url, json=payload, timeout=(10, REQUEST_TIMEOUT), stream=True) as r:
+                r.raise_for_status()
+                for line in r.iter_lines(decode_unicode=True):
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if data.get("error"):
+                        raise RuntimeError(f"Ollama: {data['error']}")
+                    piece = data.get("response") or ""
+                    if piece:
+                        if ttft is None:
+                            ttft = time.perf_counter() - t0
+                        chunks.append(piece)
+                    if data.get("done"):
+                        final = data
+                        break
+                    now = time.perf_counter()
+                    if on_partial and now - last_ckpt >= CHECKPOINT_SECONDS:
+                        on_partial(partial + "".join(chunks))
+                        last_ckpt = now
+
+            if not final:
+                raise RuntimeError("Stream de Ollama cortado antes de 'done'.")
+            text = (partial + "".join(chunks)).strip()
+            if not text:
+                raise RuntimeError("Respuesta vacía de Ollama (campo 'response' vacío).")
+
+            fill_stats(stats, final)
+            elapsed = time.perf_counter() - t0
+            eval_count = final.get("eval_count") or len(chunks)
+            hosts.release(host, True, elapsed, eval_count)
+            eval_s = (final.get("eval_duration") or 0) / 1e9 or max(elapsed - (ttft or 0.0), 1e-9)
+            log.info(
+                f"    {label} ttft={ttft or 0.0:.2f}s  {eval_count / eval_s:.1f} tok/s  "
+                f"({eval_count} tokens, {elapsed:.1f}s)"
+            )
+            return text
+        except Exception as e:
+            hosts.release(host, False, time.perf_counter() - t0)
+            last_err = e
+            partial = partial + "".join(chunks)
+            if on_partial and partial:
+                on_partial(partial)
+            log.info(f"    {label} (stream) intento {attempt} en {url} falló tras {len(partial)} caracteres: {e}")
+            time.sleep(attempt if len(hosts) == 1 else 0)
+
+    raise RuntimeError(
+        f"Fallo llamando a Ollama (stream) tras {RETRIES} intentos.\n"
+        f"- URL (último intento): {url}\n"
         f"- Modelo: {model}\n"
+        f"- Texto parcial guardado: {len(partial)} caracteres\n"
         f"- Último error: {last_err}"
     )
 
@@ -177,52 +513,531 @@ def ensure_db(conn: sqlite3.Connection) -> None:
     conn.execute(
         "CREATE UNIQUE INDEX IF NOT EXISTS uq_posts_title_category ON posts(title, category);"
     )
+    # Manifiesto de documentos ya procesados: permite saltar archivos sin cambios
+    # sin leerlos y regenerar solo los H3 cuyo texto ha cambiado.
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS doc_manifest (
+          path TEXT PRIMARY KEY,
+          mtime_ns INTEGER NOT NULL,
+          size INTEGER NOT NULL,
+          sha256 TEXT NOT NULL,
+          updated_at TEXT NOT NULL
+        );
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS doc_sections (
+          path TEXT NOT NULL,
+          title TEXT NOT NULL,
+          category TEXT NOT NULL,
+          sha256 TEXT NOT NULL,
+          PRIMARY KEY (path, title, category)
+        );
+        """
+    )
+    # Cola persistente de generaciones: sobrevive a errores y a procesos matados
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS jobs (
+          key TEXT PRIMARY KEY,
+          source_file TEXT NOT NULL,
+          title TEXT NOT NULL,
+          category TEXT NOT NULL,
+          h1 TEXT NOT NULL,
+          h2 TEXT NOT NULL,
+          h3_raw TEXT NOT NULL,
+          mode TEXT NOT NULL DEFAULT 'insert',
+          doc_context TEXT NOT NULL DEFAULT '',
+          outline TEXT NOT NULL DEFAULT '',
+          status TEXT NOT NULL DEFAULT 'pending',
+          attempts INTEGER NOT NULL DEFAULT 0,
+          last_error TEXT,
+          updated_at TEXT NOT NULL
+        );
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);")
     conn.commit()
 
 
-def existing_pairs(conn: sqlite3.Connection) -> set[Tuple[str, str]]:
-    return set(conn.execute("SELECT title, category FROM posts").fetchall())
+def sha256_text(s: str) -> str:
+    return hashlib.sha256(s.encode("utf-8")).hexdigest()
+
+
+def load_manifest(conn: sqlite3.Connection) -> Dict[str, Tuple[int, int, str]]:
+    rows = conn.execute("SELECT path, mtime_ns, size, sha256 FROM doc_manifest").fetchall()
+    return {path: (mtime_ns, size, digest) for path, mtime_ns, size, digest in rows}
+
+
+def section_hashes(conn: sqlite3.Connection, path: str) -> Dict[Tuple[str, str], str]:
+    rows = conn.execute("SELECT title, category, sha256 FROM doc_sections WHERE path=?", (path,)).fetchall()
+    return {(title, category): digest for title, category, digest in rows}
+
 
+def post_exists(conn: sqlite3.Connection, title: str, category: str) -> bool:
+    # Usa uq_posts_title_category: no hace falta cargar toda la tabla posts
+    row = conn.execute("SELECT 1 FROM posts WHERE title=? AND category=?", (title, category)).fetchone()
+    return row is not None
 
-def load_cached_content(ck: Path) -> str:
-    if not ck.is_file():
-        return ""
-    try:
-        cached = json.loads(ck.read_text(encoding="utf-8", errors="replace"))
-        content = (cached.get("content") or "").strip()
-        return content
-    except Exception:
-        return ""
+
+def save_manifest(
+    conn: sqlite3.Connection,
+    path: str,
+    st_mtime_ns: int,
+    st_size: int,
+    digest: str,
+    sections: Dict[Tuple[str, str], str] | None = None,
+) -> None:
+    conn.execute(
+        """
+        INSERT INTO doc_manifest(path, mtime_ns, size, sha256, updated_at) VALUES(?, ?, ?, ?, ?)
+        ON CONFLICT(path) DO UPDATE SET
+          mtime_ns=excluded.mtime_ns, size=excluded.size, sha256=excluded.sha256, updated_at=excluded.updated_at
+        """,
+        (path, st_mtime_ns, st_size, digest, now_iso()),
+    )
+    if sections is not None:
+        conn.execute("DELETE FROM doc_sections WHERE path=?", (path,))
+        conn.executemany(
+            "INSERT INTO doc_sections(path, title, category, sha256) VALUES(?, ?, ?, ?)",
+            [(path, title, category, h) for (title, category), h in sections.items()],
+        )
+    conn.commit()
 
 
-def save_cache(
-    ck: Path,
+@dataclass(frozen=True)
+class Job:
+    rowid: int
+    key: str
+    source_file: str
+    item: Item
+    mode: str  # 'insert' o 'update' (sección editada)
+    doc_context: str
+    outline: str
+    attempts: int
+
+
+def enqueue_job(
+    conn: sqlite3.Connection,
+    key: str,
     source_file: str,
-    category: str,
-    title: str,
-    model: str,
-    content_md: str,
     it: Item,
+    mode: str,
+    doc_context: str,
+    outline: str,
 ) -> None:
-    ck.write_text(
-        json.dumps(
-            {
-                "source_file": source_file,
-                "category": category,
-                "title": title,
-                "generated_at": now_iso(),
-                "model": model,
-                "content": content_md,
-                "hierarchy": {"h1": it.h1, "h2": it.h2, "h3_raw": it.h3_raw},
+    # Sin commit: se confirma junto con el manifiesto del documento
+    conn.execute(
+        """
+        INSERT INTO jobs(key, source_file, title, category, h1, h2, h3_raw, mode, doc_context, outline,
+                         status, attempts, last_error, updated_at)
+        VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'pending', 0, NULL, ?)
+        ON CONFLICT(key) DO UPDATE SET
+          mode=excluded.mode, doc_context=excluded.doc_context, outline=excluded.outline,
+          h1=excluded.h1, h2=excluded.h2, h3_raw=excluded.h3_raw,
+          status='pending', attempts=0, last_error=NULL, updated_at=excluded.updated_at
+        """,
+        (key, source_file, it.title, it.category, it.h1, it.h2, it.h3_raw, mode, doc_context, outline, now_iso()),
+    )
+
+
+def recover_jobs(conn: sqlite3.Connection, retry_failed: bool = False) -> Tuple[int, int]:
+    """
+    Al arrancar: los 'running' de un proceso que murió vuelven a 'pending', y
+    los 'failed' se reintentan mientras no hayan agotado JOB_MAX_ATTEMPTS (o
+    todos, con `retry_failed`). Devuelve (recuperados, reintentados).
+    """
+    recovered = conn.execute("UPDATE jobs SET status='pending' WHERE status='running'").rowcount
+    if retry_failed:
+        retried = conn.execute("UPDATE jobs SET status='pending' WHERE status='failed'").rowcount
+    else:
+        retried = conn.execute(
+            "UPDATE jobs SET status='pending' WHERE status='failed' AND attempts < ?", (JOB_MAX_ATTEMPTS,)
+        ).rowcount
+    conn.commit()
+    return recovered, retried
+
+
+def next_jobs(conn: sqlite3.Connection, after_rowid: int, limit: int) -> List[Job]:
+    rows = conn.execute(
+        """
+        SELECT rowid, key, source_file, title, category, h1, h2, h3_raw, mode, doc_context, outline, attempts
+        FROM jobs WHERE status='pending' AND rowid > ? ORDER BY rowid LIMIT ?
+        """,
+        (after_rowid, limit),
+    ).fetchall()
+    return [
+        Job(
+            rowid=r[0], key=r[1], source_file=r[2],
+            item=Item(title=r[3], category=r[4], h1=r[5], h2=r[6], h3_raw=r[7]),
+            mode=r[8], doc_context=r[9], outline=r[10], attempts=r[11],
+        )
+        for r in rows
+    ]
+
+
+def mark_job(conn: sqlite3.Connection, job: Job, status: str, error: str | None = None) -> None:
+    if status == "done":
+        # El contexto ya no hace falta; se libera para que la tabla no crezca
+        conn.execute(
+            "UPDATE jobs SET status='done', doc_context='', outline='', last_error=NULL, updated_at=? WHERE key=?",
+            (now_iso(), job.key),
+        )
+    elif status == "failed":
+        conn.execute(
+            "UPDATE jobs SET status='failed', attempts=attempts+1, last_error=?, updated_at=? WHERE key=?",
+            (error, now_iso(), job.key),
+        )
+    else:
+        conn.execute("UPDATE jobs SET status=?, updated_at=? WHERE key=?", (status, now_iso(), job.key))
+    conn.commit()
+
+
+def job_counts(conn: sqlite3.Connection) -> Dict[str, int]:
+    return dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+
+class ArticleCache:
+    """
+    Cache de artículos generados en una única base SQLite (contenido comprimido
+    con zlib), con la misma clave sha256 que usaban los antiguos JSON sueltos.
+    Se comparte entre hilos, así que todas las operaciones van bajo un lock.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("PRAGMA synchronous=NORMAL;")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS article_cache (
+              key TEXT PRIMARY KEY,
+              source_file TEXT NOT NULL,
+              title TEXT NOT NULL,
+              category TEXT NOT NULL,
+              model TEXT NOT NULL,
+              generated_at TEXT NOT NULL,
+              accessed_at REAL NOT NULL,
+              partial INTEGER NOT NULL DEFAULT 0,
+              hierarchy TEXT NOT NULL DEFAULT '{}',
+              content BLOB NOT NULL
+            );
+            """
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_source ON article_cache(source_file);")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON article_cache(accessed_at);")
+        self.conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+    def __enter__(self) -> "ArticleCache":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @staticmethod
+    def _unpack(blob: bytes) -> str:
+        return zlib.decompress(blob).decode("utf-8", errors="replace")
+
+    def _get(self, key: str, partial: bool) -> str:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT content FROM article_cache WHERE key=? AND partial=?", (key, int(partial))
+            ).fetchone()
+            if row is None:
+                return ""
+            self.conn.execute("UPDATE article_cache SET accessed_at=? WHERE key=?", (time.time(), key))
+            self.conn.commit()
+        return self._unpack(row[0])
+
+    def get(self, key: str) -> str:
+        return self._get(key, partial=False).strip()
+
+    def get_partial(self, key: str) -> str:
+        # Texto de un stream que no llegó a terminar (checkpoint)
+        return self._get(key, partial=True)
+
+    def put(
+        self,
+        key: str,
+        source_file: str,
+        it: Item,
+        model: str,
+        content_md: str,
+        partial: bool = False,
+        generated_at: str | None = None,
+    ) -> None:
+        hierarchy = json.dumps({"h1": it.h1, "h2": it.h2, "h3_raw": it.h3_raw}, ensure_ascii=False)
+        blob = zlib.compress(content_md.encode("utf-8"))
+        with self._lock:
+            self.conn.execute(
+                """
+                INSERT OR REPLACE INTO article_cache
+                  (key, source_file, title, category, model, generated_at, accessed_at, partial, hierarchy, content)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    key, source_file, it.title, it.category, model, generated_at or now_iso(),
+                    time.time(), int(partial), hierarchy, blob,
+                ),
+            )
+            self.conn.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self.conn.execute("DELETE FROM article_cache WHERE key=?", (key,))
+            self.conn.commit()
+
+    def evict(self, max_mb: float | None = None, max_age_days: float | None = None) -> int:
+        """
+        Política de expulsión: primero por antigüedad de último uso y después,
+        si sigue superando `max_mb`, las entradas usadas hace más tiempo (LRU).
+        """
+        removed = 0
+        with self._lock:
+            if max_age_days is not None:
+                cutoff = time.time() - max_age_days * 86400
+                removed += self.conn.execute("DELETE FROM article_cache WHERE accessed_at < ?", (cutoff,)).rowcount
+            if max_mb is not None:
+                budget = int(max_mb * 1024 * 1024)
+                total = self.conn.execute("SELECT COALESCE(SUM(LENGTH(content)), 0) FROM article_cache").fetchone()[0]
+                if total > budget:
+                    victims: List[Tuple[str]] = []
+                    for key, size in self.conn.execute(
+                        "SELECT key, LENGTH(content) FROM article_cache ORDER BY accessed_at ASC"
+                    ):
+                        if total <= budget:
+                            break
+                        victims.append((key,))
+                        total -= size
+                    self.conn.executemany("DELETE FROM article_cache WHERE key=?", victims)
+                    removed += len(victims)
+            self.conn.commit()
+        return removed
+
+    def migrate_json(self, cache_dir: Path) -> int:
+        """Importa los antiguos <hash>.json de `cache_dir` y los borra (los ilegibles o vacíos se dejan)."""
+        migrated = 0
+        for fp in sorted(cache_dir.glob("*.json")):
+            try:
+                cached = json.loads(fp.read_text(encoding="utf-8", errors="replace"))
+            except Exception:
+                log.info(f"[cache] JSON ilegible, se deja sin migrar: {fp.name}")
+                continue
+            content = cached.get("content") or ""
+            if not content:
+                log.info(f"[cache] JSON sin contenido, se deja sin migrar: {fp.name}")
+                continue
+            h = cached.get("hierarchy") or {}
+            it = Item(
+                title=cached.get("title") or "",
+                category=cached.get("category") or "",
+                h1=h.get("h1", ""),
+                h2=h.get("h2", ""),
+                h3_raw=h.get("h3_raw", ""),
+            )
+            self.put(
+                fp.stem, cached.get("source_file") or "", it, cached.get("model") or "",
+                content, partial=bool(cached.get("partial")), generated_at=cached.get("generated_at"),
+            )
+            migrated += 1
+            fp.unlink()
+        return migrated
+
+
+def make_session(workers: int, n_hosts: int = 1) -> requests.Session:
+    session = requests.Session()
+    # Un único pool de conexiones (uno por host) compartido por todos los hilos
+    adapter = HTTPAdapter(pool_connections=max(1, n_hosts), pool_maxsize=max(1, workers))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def generate_item(
+    session: requests.Session,
+    cache: ArticleCache,
+    doc_context: str,
+    outline: str,
+    source_file: str,
+    it: Item,
+    ck: str,
+    model: str,
+    hosts: HostPool,
+    max_context_chars: int,
+    stream: bool = STREAM,
+    stats: dict | None = None,
+    num_ctx: int = NUM_CTX,
+) -> str:
+    # Los tiempos por etapa se dejan en `stats` y los agrega el hilo principal
+    stats = {} if stats is None else stats
+    t0 = time.perf_counter()
+    prompt = build_prompt(doc_context, it.category, it.title, max_chars=max_context_chars, outline=outline)
+    t1 = time.perf_counter()
+    if stream:
+        def checkpoint(text: str) -> None:
+            cache.put(ck, source_file, it, model, text, partial=True)
+
+        content_md = ollama_generate_stream(
+            session, prompt, model=model, hosts=hosts,
+            on_partial=checkpoint, partial=cache.get_partial(ck), label=it.title, stats=stats,
+            num_ctx=num_ctx,
+        )
+    else:
+        content_md = ollama_generate(session, prompt, model=model, hosts=hosts, stats=stats, num_ctx=num_ctx)
+    t2 = time.perf_counter()
+    if len(content_md) < 200:
+        raise RuntimeError(f"Contenido demasiado corto generado para: {it.title}")
+
+    cache.put(ck, source_file, it, model, content_md)
+    t3 = time.perf_counter()
+    stats.update(prompt_chars=len(prompt), t_prompt=t1 - t0, t_ollama=t2 - t1, t_cache=t3 - t2)
+    time.sleep(SLEEP_BETWEEN_CALLS)
+    return content_md
+
+
+def percentile(values: List[float], q: float) -> float:
+    # Percentil por rango más cercano (suficiente para informes)
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[k]
+
+
+class RunMetrics:
+    """
+    Tiempos por etapa (acumulados; con varios workers la etapa "ollama" puede
+    superar al tiempo de pared) y métricas de Ollama por artículo.
+    """
+
+    def __init__(self) -> None:
+        self.run_id = uuid.uuid4().hex[:12]
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.articles: List[dict] = []
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - t0)
+
+    def add_stage(self, name: str, seconds: float) -> None:
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_article(self, model: str, num_ctx: int, source_file: str, it: Item, stats: dict) -> None:
+        for stage in ("prompt", "ollama", "cache"):
+            self.add_stage(stage, stats.get(f"t_{stage}", 0.0))
+        rec = {
+            "model": model,
+            "num_ctx": num_ctx,
+            "source_file": source_file,
+            "title": it.title,
+            "category": it.category,
+            "latency_s": round(stats.get("t_ollama", 0.0), 3),
+            "prompt_chars": stats.get("prompt_chars", 0),
+        }
+        for k in STAT_FIELDS:
+            if k in stats:
+                rec[k] = stats[k]
+        if stats.get("eval_duration"):
+            rec["eval_tps"] = round(stats.get("eval_count", 0) / (stats["eval_duration"] / 1e9), 2)
+        if stats.get("prompt_eval_duration"):
+            rec["prompt_eval_tps"] = round(stats.get("prompt_eval_count", 0) / (stats["prompt_eval_duration"] / 1e9), 2)
+        self.articles.append(rec)
+
+    def summary(self) -> dict:
+        by_model: Dict[str, dict] = {}
+        for model in sorted({(a["model"], a["num_ctx"]) for a in self.articles}):
+            arts = [a for a in self.articles if (a["model"], a["num_ctx"]) == model]
+            lat = [a["latency_s"] for a in arts]
+            tps = [a["eval_tps"] for a in arts if "eval_tps" in a]
+            ptps = [a["prompt_eval_tps"] for a in arts if "prompt_eval_tps" in a]
+            eval_count = sum(a.get("eval_count", 0) for a in arts)
+            eval_s = sum(a.get("eval_duration", 0) for a in arts) / 1e9
+            by_model[f"{model[0]}@{model[1]}"] = {
+                "model": model[0],
+                "num_ctx": model[1],
+                "articles": len(arts),
+                "latency_p50_s": round(percentile(lat, 50), 3),
+                "latency_p95_s": round(percentile(lat, 95), 3),
+                "eval_tps_p50": round(percentile(tps, 50), 2),
+                "eval_tps_p95": round(percentile(tps, 95), 2),
+                "eval_tps_total": round(eval_count / eval_s, 2) if eval_s else 0.0,
+                "prompt_eval_tps_p50": round(percentile(ptps, 50), 2),
+                "prompt_eval_count": sum(a.get("prompt_eval_count", 0) for a in arts),
+                "eval_count": eval_count,
+            }
+        return {
+            "wall_s": round(time.perf_counter() - self.started, 3),
+            "stages_s": {k: round(v, 3) for k, v in sorted(self.stages.items())},
+            "ollama_server_s": {
+                "prompt_eval": round(sum(a.get("prompt_eval_duration", 0) for a in self.articles) / 1e9, 3),
+                "eval": round(sum(a.get("eval_duration", 0) for a in self.articles) / 1e9, 3),
             },
-            ensure_ascii=False,
-            indent=2,
-        ),
-        encoding="utf-8",
+            "by_model": by_model,
+        }
+
+    def write_jsonl(self, path: Path, meta: dict) -> dict:
+        summary = {"type": "run", "run_id": self.run_id, "finished_at": now_iso(), **meta, **self.summary()}
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("a", encoding="utf-8") as f:
+            for rec in self.articles:
+                f.write(json.dumps({"type": "article", "run_id": self.run_id, **rec}, ensure_ascii=False) + "\n")
+            f.write(json.dumps(summary, ensure_ascii=False) + "\n")
+        return summary
+
+
+def prefix_savings(file_stats: List[dict]) -> Tuple[int, float]:
+    """
+    Estima cuánto prompt-eval se ahorró en un documento gracias al prefijo
+    compartido. Ollama solo cuenta en `prompt_eval_count` los tokens que ha
+    tenido que evaluar. Como cada H3 tiene un prompt de distinta longitud, cada
+    llamada se compara con su propio tamaño (`prompt_chars`): la llamada con más
+    tokens por carácter se toma como la evaluada en frío y da la proporción
+    tokens/carácter. Devuelve (tokens, segundos).
+    """
+    calls = [st for st in file_stats if st.get("prompt_eval_count") and st.get("prompt_chars")]
+    if len(calls) < 2:
+        return 0, 0.0
+    cold = max(calls, key=lambda st: st["prompt_eval_count"] / st["prompt_chars"])
+    tokens_per_char = cold["prompt_eval_count"] / cold["prompt_chars"]
+    ns_per_token = cold.get("prompt_eval_duration", 0) / cold["prompt_eval_count"]
+    saved = sum(
+        max(0, round(st["prompt_chars"] * tokens_per_char) - st["prompt_eval_count"])
+        for st in calls if st is not cold
     )
+    return saved, saved * ns_per_token / 1e9
 
 
-def run(docs_dir: Path, db_path: Path, model: str, ollama_url: str, max_context_chars: int) -> None:
+def run(
+    docs_dir: Path,
+    db_path: Path,
+    model: str,
+    ollama_url: str | List[str],
+    max_context_chars: int,
+    workers: int = WORKERS,
+    stream: bool = STREAM,
+    section_chars: int = SECTION_CONTEXT_CHARS,
+    rescan: bool = False,
+    cache_db: Path = CACHE_DB,
+    cache_max_mb: float | None = CACHE_MAX_MB,
+    cache_max_age_days: float | None = CACHE_MAX_AGE_DAYS,
+    num_ctx: int = NUM_CTX,
+    report_path: Path | None = REPORT_PATH,
+    retry_failed: bool = False,
+) -> None:
     if not docs_dir.is_dir():
         raise SystemExit(f"ERROR: No existe la carpeta: {docs_dir}")
 
@@ -231,77 +1046,256 @@ def run(docs_dir: Path, db_path: Path, model: str, ollama_url: str, max_context_
         log.info(f"No se encontraron .md en {docs_dir}")
         return
 
-    with sqlite3.connect(db_path) as conn, requests.Session() as session:
+    hosts = HostPool([ollama_url] if isinstance(ollama_url, str) else list(ollama_url))
+    workers = max(1, workers)
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bloggen") if workers > 1 else None
+
+    with sqlite3.connect(db_path) as conn, make_session(workers, len(hosts)) as session, ArticleCache(cache_db) as cache:
         ensure_db(conn)
-        seen = existing_pairs(conn)
+        migrated = cache.migrate_json(cache_db.parent)  # los JSON vivían junto a la cache
+        if migrated:
+            log.info(f"[cache] Migrados {migrated} JSON a {cache_db}")
+        manifest = {} if rescan else load_manifest(conn)
+        recovered, retried = recover_jobs(conn, retry_failed=retry_failed)
 
         inserted = 0
+        updated = 0
         skipped = 0
+        failed = 0
+        unchanged_files = 0
+        prefix_report: List[Tuple[str, int, float]] = []
+        metrics = RunMetrics()
+        status = "error"
 
         log.info(f"Encontrados {len(md_files)} archivos en {docs_dir}")
         log.info(f"DB: {db_path}")
         log.info(f"Modelo: {model}")
+        log.info(f"Ollama: {', '.join(h.url for h in hosts.hosts)}")
+        if len(hosts) > 1 and workers < len(hosts):
+            log.info(f"  Aviso: con {len(hosts)} hosts conviene --workers >= {len(hosts)}")
+        log.info(f"Workers: {workers}  Stream: {'sí' if stream else 'no'}  num_ctx: {num_ctx}")
+        if recovered or retried:
+            log.info(f"Cola: {recovered} trabajos interrumpidos recuperados, {retried} fallidos reintentados")
         log.info("-" * 70)
 
-        for md_path in md_files:
-            raw = md_path.read_text(encoding="utf-8", errors="replace").strip()
-            body = strip_front_matter(raw)
-
-            file_stem = md_path.stem.strip() or md_path.name
-            items = extract_items(body, file_stem=file_stem)
-            if not items:
-                log.info(f"[SKIP] {md_path.name}: no hay headings ###")
-                continue
-
-            log.info(f"\n[{md_path.name}] H3 encontrados: {len(items)}")
-            batch_rows: List[Tuple[str, str, str, str]] = []
-
-            for it in items:
-                key = (it.title, it.category)
-                if key in seen:
-                    skipped += 1
-                    log.info(f"  - (skip) Ya existe: [{it.category}] {it.title}")
+        try:
+            # 1) Escaneo: todo lo que falta se encola, también lo que ya está en cache
+            #    (se resuelve al despacharlo), así los posts se escriben en el orden del
+            #    documento. Trabajos y manifiesto de cada documento van en la misma transacción.
+            for md_path in md_files:
+                with metrics.stage("read"):
+                    st = md_path.stat()
+                    known_file = manifest.get(md_path.name)
+                    if known_file and known_file[:2] == (st.st_mtime_ns, st.st_size):
+                        unchanged_files += 1
+                        continue
+
+                    raw = md_path.read_text(encoding="utf-8", errors="replace").strip()
+                    file_digest = sha256_text(raw)
+                if known_file and known_file[2] == file_digest:
+                    # Solo ha cambiado el mtime (touch, checkout...): se actualiza y listo
+                    with metrics.stage("sqlite"):
+                        save_manifest(conn, md_path.name, st.st_mtime_ns, st.st_size, file_digest)
+                    unchanged_files += 1
                     continue
 
-                ck = cache_path(md_path.name, it.title, it.category)
+                with metrics.stage("parse"):
+                    body = strip_front_matter(raw)
+
+                    file_stem = md_path.stem.strip() or md_path.name
+                    items = extract_items(body, file_stem=file_stem)
+                    sections = index_sections(body)
+                    outline = build_outline(sections)
+                if not items:
+                    log.info(f"[SKIP] {md_path.name}: no hay headings ###")
+                    with metrics.stage("sqlite"):
+                        save_manifest(conn, md_path.name, st.st_mtime_ns, st.st_size, file_digest, {})
+                    continue
 
-                content_md = load_cached_content(ck)
-                if content_md:
-                    log.info(f"  - (cache→db) [{it.category}] {it.title}")
+                log.info(f"\n[{md_path.name}] H3 encontrados: {len(items)}")
+                window = min(section_chars, max_context_chars)
+
+                sec_by_offset = {sec.start: sec for sec in sections if sec.level == 3}
+                with metrics.stage("lookup"):
+                    known_sections = section_hashes(conn, md_path.name)
+                new_sections: Dict[Tuple[str, str], str] = {}
+                seen: set[Tuple[str, str]] = set()
+                queued = 0
+
+                for it in items:
+                    key = (it.title, it.category)
+                    if key in seen:
+                        skipped += 1
+                        log.info(f"  - (skip) Duplicado en el archivo: [{it.category}] {it.title}")
+                        continue
+                    seen.add(key)
+
+                    sec = sec_by_offset.get(it.offset)
+                    sec_hash = sha256_text(body[sec.start:sec.end].strip() if sec else it.h3_raw)
+                    new_sections[key] = sec_hash
+
+                    ck = cache_key(md_path.name, it.title, it.category)
+                    with metrics.stage("lookup"):
+                        exists = post_exists(conn, it.title, it.category)
+                    mode = "insert"
+                    if exists:
+                        old_hash = known_sections.get(key)
+                        if old_hash is None or old_hash == sec_hash:
+                            skipped += 1
+                            log.info(f"  - (skip) Ya existe: [{it.category}] {it.title}")
+                            continue
+                        # Sección editada: la cache es del texto anterior
+                        mode = "update"
+                        cache.delete(ck)
+
+                    log.info(f"  - (cola:{mode}) [{it.category}] {it.title}")
+                    with metrics.stage("context"):
+                        doc_context = section_context(body, sections, it.offset, window)
+                    enqueue_job(conn, ck, md_path.name, it, mode, doc_context, outline)
+                    queued += 1
+
+                # SQLite solo se toca desde el hilo principal
+                with metrics.stage("sqlite"):
+                    save_manifest(conn, md_path.name, st.st_mtime_ns, st.st_size, file_digest, new_sections)
+
+            # 2) Cola: se procesan los trabajos pendientes (de esta ejecución o de
+            #    una anterior que se cortó). Un fallo deja el trabajo en 'failed' y sigue.
+            file_stats: Dict[str, List[dict]] = {}
+            inflight: Dict[Future[str], Tuple[Job, dict]] = {}
+
+            def dispatch(job: Job) -> Future[str]:
+                mark_job(conn, job, "running")
+                stats: dict = {}
+                # Si el proceso murió entre guardar en cache y escribir en la DB, no se regenera
+                cached = cache.get(job.key)
+                if cached:
+                    log.info(f"  - (cache→db) [{job.item.category}] {job.item.title}")
+                    fut: Future[str] = Future()
+                    fut.set_result(cached)
                 else:
-                    log.info(f"  - (gen) [{it.category}] {it.title}")
-                    prompt = build_prompt(raw, it.category, it.title, max_chars=max_context_chars)
-                    content_md = ollama_generate(session, prompt, model=model, url=ollama_url)
-                    if len(content_md) < 200:
-                        raise RuntimeError(f"Contenido demasiado corto generado para: {it.title}")
-
-                    save_cache(
-                        ck=ck,
-                        source_file=md_path.name,
-                        category=it.category,
-                        title=it.title,
-                        model=model,
-                        content_md=content_md,
-                        it=it,
+                    log.info(f"  - ({'regen' if job.mode == 'update' else 'gen'}) [{job.item.category}] {job.item.title}")
+                    args = (
+                        session, cache, job.doc_context, job.outline, job.source_file, job.item, job.key,
+                        model, hosts, max_context_chars, stream, stats,
                     )
-                    time.sleep(SLEEP_BETWEEN_CALLS)
-
-                batch_rows.append((now_iso(), it.title, content_md, it.category))
-                seen.add(key)
-
-            if batch_rows:
-                before = conn.total_changes
-                conn.executemany(
-                    "INSERT OR IGNORE INTO posts(date, title, content, category) VALUES(?, ?, ?, ?)",
-                    batch_rows,
-                )
-                conn.commit()
-                inserted += max(0, conn.total_changes - before)
-
+                    if pool is not None:
+                        fut = pool.submit(generate_item, *args, num_ctx=num_ctx)
+                    else:
+                        fut = Future()
+                        try:
+                            fut.set_result(generate_item(*args, num_ctx=num_ctx))
+                        except Exception as e:
+                            fut.set_exception(e)
+                inflight[fut] = (job, stats)
+                return fut
+
+            def collect(fut: Future[str]) -> None:
+                nonlocal inserted, updated, failed
+                job, stats = inflight.pop(fut)
+                err = fut.exception()
+                if err is not None:
+                    failed += 1
+                    mark_job(conn, job, "failed", f"{type(err).__name__}: {err}")
+                    log.info(f"  ! (cuarentena) [{job.item.category}] {job.item.title}: {str(err).splitlines()[0]}")
+                    return
+                content_md = fut.result()
+                if stats:
+                    metrics.add_article(model, num_ctx, job.source_file, job.item, stats)
+                    file_stats.setdefault(job.source_file, []).append(stats)
+                with metrics.stage("sqlite"):
+                    if job.mode == "update":
+                        conn.execute(
+                            "UPDATE posts SET content=?, date=? WHERE title=? AND category=?",
+                            (content_md, now_iso(), job.item.title, job.item.category),
+                        )
+                        updated += 1
+                    else:
+                        before = conn.total_changes
+                        conn.execute(
+                            "INSERT OR IGNORE INTO posts(date, title, content, category) VALUES(?, ?, ?, ?)",
+                            (now_iso(), job.item.title, content_md, job.item.category),
+                        )
+                        inserted += max(0, conn.total_changes - before)
+                    mark_job(conn, job, "done")  # confirma post + estado en el mismo commit
+
+            def collect_some() -> None:
+                done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    collect(fut)
+
+            if job_counts(conn).get("pending"):
+                log.info("\n[cola] Procesando trabajos pendientes")
+            last_rowid = 0
+            while True:
+                batch = next_jobs(conn, last_rowid, max(8, workers * 4))
+                if not batch:
+                    break
+                for job in batch:
+                    last_rowid = job.rowid
+                    # Como mucho 2×workers trabajos en vuelo; el resto espera en la tabla
+                    while len(inflight) >= workers * 2:
+                        collect_some()
+                    fut = dispatch(job)
+                    if pool is None:
+                        collect(fut)
+            while inflight:
+                collect_some()
+
+            for name, stats_list in file_stats.items():
+                saved_tokens, saved_s = prefix_savings(stats_list)
+                prefix_report.append((name, saved_tokens, saved_s))
+            status = "ok"
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True, cancel_futures=True)
+            report = None
+            if report_path is not None:
+                report = metrics.write_jsonl(report_path, {
+                    "status": status,
+                    "model": model,
+                    "num_ctx": num_ctx,
+                    "workers": workers,
+                    "stream": stream,
+                    "hosts": [h.url for h in hosts.hosts],
+                    "docs_dir": str(docs_dir),
+                    "inserted": inserted,
+                    "updated": updated,
+                    "skipped": skipped,
+                    "failed": failed,
+                })
+
+        counts = job_counts(conn)
         log.info("\n" + "=" * 70)
         log.info(f"Insertados: {inserted}")
+        log.info(f"Actualizados (sección editada): {updated}")
         log.info(f"Saltados (ya existían): {skipped}")
-        log.info(f"Cache: {CACHE_DIR}")
+        log.info(f"Archivos sin cambios: {unchanged_files}")
+        log.info(
+            f"Cola: {failed} fallidos en esta ejecución, {counts.get('failed', 0)} en cuarentena, "
+            f"{counts.get('pending', 0)} pendientes"
+        )
+        if prefix_report:
+            log.info("Prefijo reutilizado (prompt-eval ahorrado por archivo):")
+            for name, saved_tokens, saved_s in prefix_report:
+                log.info(f"  - {name}: {saved_tokens} tokens, {saved_s:.1f}s")
+            log.info(f"  Total: {sum(r[2] for r in prefix_report):.1f}s")
+        summary = report or metrics.summary()
+        log.info(f"Tiempo total: {summary['wall_s']:.1f}s")
+        log.info("Etapas (s acumulados): " + ", ".join(f"{k}={v:.2f}" for k, v in summary["stages_s"].items()))
+        for m in summary["by_model"].values():
+            log.info(
+                f"  {m['model']} (num_ctx={m['num_ctx']}): {m['articles']} artículos, "
+                f"latencia p50={m['latency_p50_s']:.1f}s p95={m['latency_p95_s']:.1f}s, "
+                f"{m['eval_tps_total']:.1f} tok/s"
+            )
+        if report_path is not None:
+            log.info(f"Informe: {report_path} (run_id={metrics.run_id})")
+        if len(hosts) > 1 or hosts.hosts[0].requests:
+            log.info("Hosts Ollama:")
+            for line in hosts.summary_lines():
+                log.info(line)
+        evicted = cache.evict(max_mb=cache_max_mb, max_age_days=cache_max_age_days)
+        log.info(f"Cache: {cache_db}" + (f" ({evicted} entradas expulsadas)" if evicted else ""))
         log.info("=" * 70)
 
 
@@ -310,16 +1304,48 @@ def main() -> None:
     parser.add_argument("--docs", type=str, default=str(DOCS_DIR), help="Carpeta con .md")
     parser.add_argument("--db", type=str, default=str(DB_PATH), help="Ruta a SQLite")
     parser.add_argument("--model", type=str, default=MODEL, help="Modelo Ollama")
-    parser.add_argument("--url", type=str, default=OLLAMA_URL, help="URL API Ollama /api/generate")
+    parser.add_argument(
+        "--url", type=str, nargs="+", default=[OLLAMA_URL],
+        help="URL(s) API Ollama /api/generate (varias separadas por espacio o coma)",
+    )
     parser.add_argument("--max-context", type=int, default=MAX_CONTEXT_CHARS, help="Máx caracteres de contexto")
+    parser.add_argument(
+        "--section-context", type=int, default=SECTION_CONTEXT_CHARS,
+        help="Máx caracteres de secciones relacionadas con cada H3",
+    )
+    parser.add_argument("--workers", type=int, default=WORKERS, help="Generaciones simultáneas (1 = secuencial)")
+    parser.add_argument("--stream", action="store_true", default=STREAM, help="Respuesta en streaming con checkpoints en cache")
+    parser.add_argument("--cache-db", type=str, default=str(CACHE_DB), help="Ruta a la cache SQLite de artículos")
+    parser.add_argument("--cache-max-mb", type=float, default=CACHE_MAX_MB, help="Tamaño máximo de la cache (MB)")
+    parser.add_argument(
+        "--cache-max-age-days", type=float, default=CACHE_MAX_AGE_DAYS,
+        help="Expulsa entradas de cache no usadas en N días",
+    )
+    parser.add_argument("--num-ctx", type=int, default=NUM_CTX, help="Ventana de contexto de Ollama (num_ctx)")
+    parser.add_argument("--report", type=str, default=str(REPORT_PATH), help="Informe JSONL de la ejecución ('' = no escribir)")
+    parser.add_argument(
+        "--retry-failed", action="store_true",
+        help="Vuelve a encolar todos los trabajos en cuarentena (aunque hayan agotado intentos)",
+    )
+    parser.add_argument("--rescan", action="store_true", help="Ignora el manifiesto y vuelve a leer todos los .md")
     args = parser.parse_args()
 
     run(
         docs_dir=Path(args.docs),
         db_path=Path(args.db),
         model=args.model,
-        ollama_url=args.url,
+        ollama_url=[u.strip() for arg in args.url for u in arg.split(",") if u.strip()],
         max_context_chars=args.max_context,
+        workers=args.workers,
+        stream=args.stream,
+        section_chars=args.section_context,
+        rescan=args.rescan,
+        cache_db=Path(args.cache_db),
+        cache_max_mb=args.cache_max_mb,
+        cache_max_age_days=args.cache_max_age_days,
+        num_ctx=args.num_ctx,
+        report_path=Path(args.report) if args.report else None,
+        retry_failed=args.retry_failed,
     )
 
 
@@ -1,6 +1,11 @@
-from flask import Flask, request, redirect, session, url_for, render_template_string
+from flask import Flask, request, redirect, session, url_for, render_template_string, g, jsonify
 import mysql.connector
+import base64
+import json
 import os
+import queue
+import threading
+import time
 
 app = Flask(__name__)
 app.secret_key = "1234"  # en producción usa una clave larga y privada
@@ -17,13 +22,135 @@ ADMIN_PASS = "Javier Carrasco"
 
 ESTADOS = ["Nuevo", "Contactado", "En seguimiento", "Ganado", "Perdido"]
 
+# Pool de conexiones: tamaño máximo, espera máxima para conseguir una y
+# segundos de inactividad a partir de los cuales se comprueba con ping
+POOL_SIZE = int(os.environ.get("CRM_POOL_SIZE", "5"))
+POOL_TIMEOUT = float(os.environ.get("CRM_POOL_TIMEOUT", "10"))
+POOL_PING_SECONDS = float(os.environ.get("CRM_POOL_PING_SECONDS", "30"))
+
+# Cache del esquema de 'inscripciones': se relee entero cada SCHEMA_TTL segundos
+# y, entre medias, cada SCHEMA_CHECK_SECONDS se compara la lista de columnas
+SCHEMA_TTL = float(os.environ.get("CRM_SCHEMA_TTL", "300"))
+SCHEMA_CHECK_SECONDS = float(os.environ.get("CRM_SCHEMA_CHECK_SECONDS", "15"))
+
+# Panel admin: filas por página (se cargan más bajo demanda) y máximo permitido
+PAGE_SIZE = int(os.environ.get("CRM_PAGE_SIZE", "50"))
+PAGE_MAX = 500
+
+# El total de inscripciones (para "Sin estado") es un COUNT(*) que recorre un índice
+# entero: se recalcula como mucho cada COUNT_TTL segundos
+COUNT_TTL = float(os.environ.get("CRM_COUNT_TTL", "60"))
+
 
 def conectar():
     return mysql.connector.connect(**DB)
 
 
-def get_columnas():
-    con = conectar()
+class PoolConexiones:
+    def __init__(self, size=POOL_SIZE, timeout=POOL_TIMEOUT, ping_seconds=POOL_PING_SECONDS):
+        self.size = size
+        self.timeout = timeout
+        self.ping_seconds = ping_seconds
+        self._libres = queue.LifoQueue()  # (conexion, momento en que se devolvió)
+        self._huecos = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self.stats = {
+            "created": 0, "in_use": 0, "checkouts": 0, "timeouts": 0, "discarded": 0,
+            "wait_total_s": 0.0, "wait_max_s": 0.0,
+        }
+
+    def _sana(self):
+        # Reutiliza la última devuelta; si lleva tiempo parada se comprueba antes
+        while True:
+            try:
+                con, desde = self._libres.get_nowait()
+            except queue.Empty:
+                con = conectar()
+                with self._lock:
+                    self.stats["created"] += 1
+                return con
+            if time.monotonic() - desde < self.ping_seconds:
+                return con
+            try:
+                con.ping(reconnect=False)
+                return con
+            except mysql.connector.Error:
+                with self._lock:
+                    self.stats["discarded"] += 1
+                try:
+                    con.close()
+                except mysql.connector.Error:
+                    pass
+
+    def checkout(self):
+        t0 = time.perf_counter()
+        if not self._huecos.acquire(timeout=self.timeout):
+            with self._lock:
+                self.stats["timeouts"] += 1
+            raise RuntimeError(f"No hay conexiones libres tras {self.timeout}s (pool de {self.size})")
+        espera = time.perf_counter() - t0
+        try:
+            con = self._sana()
+        except Exception:
+            self._huecos.release()
+            raise
+        with self._lock:
+            self.stats["in_use"] += 1
+            self.stats["checkouts"] += 1
+            self.stats["wait_total_s"] += espera
+            self.stats["wait_max_s"] = max(self.stats["wait_max_s"], espera)
+        return con
+
+    def devolver(self, con):
+        try:
+            # Una transacción abierta (aunque sea de un SELECT) dejaría una
+            # instantánea vieja para la siguiente petición
+            if con.in_transaction:
+                con.rollback()
+            self._libres.put((con, time.monotonic()))
+        except mysql.connector.Error:
+            with self._lock:
+                self.stats["discarded"] += 1
+            # Sin cerrar, la conexión seguiría abierta en el servidor hasta wait_timeout
+            try:
+                con.close()
+            except mysql.connector.Error:
+                pass
+        finally:
+            with self._lock:
+                self.stats["in_use"] -= 1
+            self._huecos.release()
+
+    def metricas(self):
+        with self._lock:
+            m = dict(self.stats)
+        m["size"] = self.size
+        m["idle"] = self._libres.qsize()
+        m["wait_avg_ms"] = round(1000 * m["wait_total_s"] / m["checkouts"], 2) if m["checkouts"] else 0.0
+        m["wait_max_ms"] = round(1000 * m.pop("wait_max_s"), 2)
+        m.pop("wait_total_s")
+        return m
+
+
+pool = PoolConexiones()
+
+
+def get_db():
+    # Una conexión por petición: se pide la primera vez y se devuelve al terminar
+    if "db" not in g:
+        g.db = pool.checkout()
+    return g.db
+
+
+@app.teardown_appcontext
+def devolver_db(exc):
+    con = g.pop("db", None)
+    if con is not None:
+        pool.devolver(con)
+
+
+def leer_columnas():
+    con = get_db()
     cur = con.cursor(dictionary=True)
     cur.execute("""
         SELECT COLUMN_NAME, COLUMN_TYPE, COLUMN_KEY, COLUMN_DEFAULT, COLUMN_COMMENT
@@ -33,7 +160,6 @@ def get_columnas():
     """, (DB["database"],))
     cols = cur.fetchall()
     cur.close()
-    con.close()
     return cols
 
 
@@ -50,61 +176,387 @@ def es_excluida(col):
     return False
 
 
+CAMPOS_HTML = """
+          {% for c in cols %}
+            <div class="row">
+              <label>Introduce {{c.COLUMN_NAME}}</label>
+              {% if c.COLUMN_COMMENT %}
+                <div style="font-size:.85em;color:#666;">{{c.COLUMN_COMMENT}}</div>
+              {% endif %}
+
+              {% if "tinyint" in c.COLUMN_TYPE.lower() %}
+                <input type="checkbox" name="{{c.COLUMN_NAME}}">
+              {% elif "text" in c.COLUMN_TYPE.lower() %}
+                <textarea name="{{c.COLUMN_NAME}}"></textarea>
+              {% else %}
+                <input type="text" name="{{c.COLUMN_NAME}}">
+              {% endif %}
+            </div>
+          {% endfor %}
+"""
+
+_esquema = None
+_esquema_lock = threading.Lock()
+
+
+def cargar_esquema(cols=None):
+    cols = leer_columnas() if cols is None else cols
+    form_cols = [c for c in cols if not es_excluida(c)]
+    campos = [c["COLUMN_NAME"] for c in form_cols]
+    ahora = time.monotonic()
+    return {
+        "cols": cols,
+        "form_cols": form_cols,
+        "pk": next((c["COLUMN_NAME"] for c in cols if c["COLUMN_KEY"] == "PRI"), None),
+        "campos": campos,
+        "checkbox": ["tinyint" in c["COLUMN_TYPE"].lower() for c in form_cols],
+        "insert_sql": f"INSERT INTO inscripciones ({','.join(campos)}) VALUES ({','.join(['%s'] * len(campos))})",
+        "form_html": render_template_string(CAMPOS_HTML, cols=form_cols),
+        "cargado": ahora,
+        "comprobado": ahora,
+    }
+
+
+def get_esquema(forzar=False):
+    global _esquema
+    e = _esquema
+    ahora = time.monotonic()
+    cols = None
+    if e and not forzar and ahora - e["cargado"] < SCHEMA_TTL:
+        if ahora - e["comprobado"] < SCHEMA_CHECK_SECONDS:
+            return e
+        # CREATE_TIME no sirve: un ALTER instantáneo (ADD/RENAME COLUMN, COMMENT) no lo cambia.
+        # Se comparan las columnas tal cual (una consulta pequeña cada SCHEMA_CHECK_SECONDS).
+        cols = leer_columnas()
+        if cols == e["cols"]:
+            e["comprobado"] = ahora
+            return e
+    with _esquema_lock:
+        # Otro hilo puede haberlo recargado mientras esperábamos
+        if _esquema is e or _esquema is None:
+            _esquema = cargar_esquema(cols)
+        return _esquema
+
+
+def invalidar_esquema():
+    global _esquema
+    _esquema = None
+
+
+def get_columnas():
+    return get_esquema()["cols"]
+
+
+def tipo_pk():
+    pk = get_pk()
+    return next((c["COLUMN_TYPE"] for c in get_columnas() if c["COLUMN_NAME"] == pk), None)
+
+
 def crear_tabla_crm_si_no_existe():
-    con = conectar()
+    # id_registro con el mismo tipo que la PK de inscripciones para que el JOIN use el índice
+    tipo = tipo_pk()
+    if not tipo:
+        raise RuntimeError(" No se encontró PK en la tabla 'inscripciones' (¿existe la tabla?). Debe tener PRIMARY KEY.")
+    con = get_db()
     cur = con.cursor()
-    cur.execute("""
+    cur.execute(f"""
         CREATE TABLE IF NOT EXISTS crm_estados_inscripciones (
             id INT AUTO_INCREMENT PRIMARY KEY,
-            id_registro VARCHAR(255) UNIQUE,
-            estado VARCHAR(50)
+            id_registro {tipo} NOT NULL UNIQUE,
+            estado VARCHAR(50),
+            INDEX idx_estado (estado)
         );
     """)
     con.commit()
     cur.close()
-    con.close()
+    migrar_tabla_crm(tipo)
+
+
+def destino_cast(tipo):
+    # Tipo de CAST de MySQL equivalente al tipo de columna (CAST no admite INT ni VARCHAR)
+    t = tipo.lower()
+    if "int" in t:
+        return "UNSIGNED" if "unsigned" in t else "SIGNED"
+    if t.startswith(("char", "varchar")) and "(" in t:
+        return "CHAR" + t[t.index("("):t.index(")") + 1]
+    return "CHAR"
+
+
+def migrar_tabla_crm(tipo):
+    # Versiones anteriores creaban id_registro como VARCHAR(255) y sin índice por estado
+    pk = get_pk()
+    con = get_db()
+    cur = con.cursor(dictionary=True)
+    cur.execute("""
+        SELECT COLUMN_TYPE FROM information_schema.columns
+        WHERE table_schema=%s AND table_name='crm_estados_inscripciones' AND column_name='id_registro'
+    """, (DB["database"],))
+    row = cur.fetchone()
+    if row and row["COLUMN_TYPE"].lower() != tipo.lower():
+        # Estados sin registro (id NULL o de registros que ya no existen): no se ven y no
+        # siempre caben en el tipo nuevo. Se mueven a una tabla aparte en vez de borrarse.
+        # NOT IN no sirve para los NULL (da NULL, no TRUE): van aparte.
+        # Tampoco caben los que no sobreviven a la conversión tal cual ("07", "7abc" o " 7"
+        # con PK numérica): el MODIFY los dejaría en 7 y chocaría con el UNIQUE.
+        huerfanos = f"""
+            id_registro IS NULL
+            OR id_registro NOT IN (SELECT CAST(`{pk}` AS CHAR) FROM inscripciones)
+            OR CAST(CAST(id_registro AS {destino_cast(tipo)}) AS CHAR) <> id_registro
+        """
+        # Los ids se leen con un SELECT aparte: en modo estricto el CAST de "7abc" dentro
+        # de un INSERT ... SELECT o un DELETE es un error, en un SELECT solo un aviso.
+        cur.execute(f"SELECT id FROM crm_estados_inscripciones WHERE {huerfanos}")
+        ids = [r["id"] for r in cur.fetchall()]
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS crm_estados_huerfanos (
+                id INT PRIMARY KEY,
+                id_registro VARCHAR(255),
+                estado VARCHAR(50),
+                movido TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+        """)
+        # Copia y borrado en la misma transacción
+        if ids:
+            marcas = ", ".join(["%s"] * len(ids))
+            cur.execute(f"""
+                INSERT INTO crm_estados_huerfanos (id, id_registro, estado)
+                SELECT id, id_registro, estado FROM crm_estados_inscripciones WHERE id IN ({marcas})
+            """, ids)
+            cur.execute(f"DELETE FROM crm_estados_inscripciones WHERE id IN ({marcas})", ids)
+        con.commit()
+        cur.execute(f"ALTER TABLE crm_estados_inscripciones MODIFY id_registro {tipo} NOT NULL")
+        print(
+            f"crm_estados_inscripciones: id_registro {row['COLUMN_TYPE']} -> {tipo}"
+            f" ({len(ids)} estados huérfanos copiados a crm_estados_huerfanos)"
+        )
+    cur.execute("SHOW INDEX FROM crm_estados_inscripciones WHERE Key_name='idx_estado'")
+    if not cur.fetchall():
+        cur.execute("ALTER TABLE crm_estados_inscripciones ADD INDEX idx_estado (estado)")
+    con.commit()
+    cur.close()
+
+
+def preparar_bd():
+    # DDL y migraciones una sola vez al arrancar, fuera de las peticiones
+    with app.app_context():
+        try:
+            crear_tabla_crm_si_no_existe()
+        except RuntimeError as e:
+            raise SystemExit(str(e).strip()) from e
+
+
+@app.cli.command("preparar-bd")
+def preparar_bd_cli():
+    """Crea/migra la tabla de estados (para arrancar con flask run o gunicorn)."""
+    preparar_bd()
+
+
+def rids_validos(rids):
+    # Solo los rid que existen en inscripciones, ya con el tipo de la PK. Con una PK
+    # numérica MySQL convertiría '7abc' en 7 al comparar: se descartan antes.
+    pk = get_pk()
+    if "int" in (tipo_pk() or "").lower():
+        valores = []
+        for r in rids:
+            try:
+                valores.append(int(str(r).strip()))
+            except ValueError:
+                pass
+    else:
+        valores = [str(r) for r in rids]
+    if not valores:
+        return []
+    con = get_db()
+    cur = con.cursor(dictionary=True)
+    cur.execute(
+        f"SELECT `{pk}` AS rid FROM inscripciones WHERE `{pk}` IN ({','.join(['%s'] * len(valores))})",
+        valores,
+    )
+    existentes = [r["rid"] for r in cur.fetchall()]
+    cur.close()
+    return existentes
+
+
+def guardar_estados(pares):
+    # Todas las filas en una transacción: executemany agrupa el upsert en un solo INSERT
+    con = get_db()
+    cur = con.cursor()
+    try:
+        cur.executemany("""
+            INSERT INTO crm_estados_inscripciones (id_registro, estado)
+            VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE estado=VALUES(estado)
+        """, pares)
+        con.commit()
+    except mysql.connector.Error:
+        con.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+_total = {"n": 0, "leido": None}
+
+
+def total_inscripciones(cur):
+    ahora = time.monotonic()
+    if _total["leido"] is None or ahora - _total["leido"] >= COUNT_TTL:
+        cur.execute("SELECT COUNT(*) AS n FROM inscripciones")
+        _total["n"] = cur.fetchone()["n"]
+        _total["leido"] = ahora
+    return _total["n"]
+
+
+def contar_estados():
+    # Recorre idx_estado y busca cada id por la PK: coste proporcional a los registros
+    # con estado, no a toda la tabla. Los estados de registros borrados no cuentan.
+    pk = get_pk()
+    con = get_db()
+    cur = con.cursor(dictionary=True)
+    cur.execute(f"""
+        SELECT c.estado, COUNT(*) AS n
+        FROM crm_estados_inscripciones c
+        JOIN inscripciones i ON i.`{pk}` = c.id_registro
+        GROUP BY c.estado
+    """)
+    cuenta = {e: 0 for e in ESTADOS}
+    for r in cur.fetchall():
+        cuenta[r["estado"]] = r["n"]
+    total = total_inscripciones(cur)
+    cur.close()
+    # Con el total cacheado, las altas de los últimos COUNT_TTL segundos aún no aparecen aquí
+    cuenta["Sin estado"] = max(0, total - sum(cuenta.values()))
+    return cuenta
 
 
 def get_pk():
-    cols = get_columnas()
-    for c in cols:
-        if c["COLUMN_KEY"] == "PRI":
-            return c["COLUMN_NAME"]
-    return None
+    return get_esquema()["pk"]
+
+
+def codificar_cursor(valor, rid):
+    # Última fila de la página: (valor de la columna de orden, PK)
+    return base64.urlsafe_b64encode(json.dumps([valor, rid], default=str).encode()).decode()
+
+
+def decodificar_cursor(cursor):
+    # Viene de la URL: cualquier cosa que no sea [valor, rid] vuelve a la primera página
+    try:
+        pos = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(pos, list):
+            raise TypeError("el cursor no es una lista")
+        valor, rid = pos
+    except (ValueError, TypeError):
+        return None
+    return valor, rid
+
+
+def condicion_keyset(col, pk, desc, valor, rid):
+    # Equivale a (col, pk) > (valor, rid) respetando que MySQL pone los NULL
+    # primero en ASC y últimos en DESC
+    op = "<" if desc else ">"
+    if col == pk:
+        return f"i.`{pk}` {op} %s", [rid]
+    if valor is None:
+        if desc:
+            return f"(i.`{col}` IS NULL AND i.`{pk}` < %s)", [rid]
+        return f"((i.`{col}` IS NULL AND i.`{pk}` > %s) OR i.`{col}` IS NOT NULL)", [rid]
+    cond = f"(i.`{col}` {op} %s OR (i.`{col}` = %s AND i.`{pk}` {op} %s)"
+    cond += f" OR i.`{col}` IS NULL)" if desc else ")"
+    return cond, [valor, valor, rid]
+
+
+def leer_pagina(sort="", desc=False, estado="", q="", cursor="", limite=PAGE_SIZE):
+    esquema = get_esquema()
+    pk = esquema["pk"]
+    nombres = [c["COLUMN_NAME"] for c in esquema["cols"]]
+    # Solo se aceptan nombres de columna reales: van dentro del SQL
+    if sort not in nombres:
+        sort = pk
+    limite = max(1, min(limite, PAGE_MAX))
+
+    donde, params = [], []
+    if estado == "Sin estado":
+        donde.append("c.estado IS NULL")
+    elif estado:
+        donde.append("c.estado = %s")
+        params.append(estado)
+    if q:
+        textos = [c["COLUMN_NAME"] for c in esquema["cols"]
+                  if any(t in c["COLUMN_TYPE"].lower() for t in ("char", "text"))]
+        if textos:
+            donde.append("(" + " OR ".join(f"i.`{n}` LIKE %s" for n in textos) + ")")
+            params += [f"%{q}%"] * len(textos)
+    pos = decodificar_cursor(cursor) if cursor else None
+    if pos:
+        cond, p = condicion_keyset(sort, pk, desc, *pos)
+        donde.append(cond)
+        params += p
+
+    orden = "DESC" if desc else "ASC"
+    order_by = f"i.`{pk}` {orden}" if sort == pk else f"i.`{sort}` {orden}, i.`{pk}` {orden}"
+    sql = f"""
+        SELECT i.*, c.estado AS _estado
+        FROM inscripciones i
+        LEFT JOIN crm_estados_inscripciones c ON c.id_registro = i.`{pk}`
+        {"WHERE " + " AND ".join(donde) if donde else ""}
+        ORDER BY {order_by}
+        LIMIT %s
+    """
+    con = get_db()
+    cur = con.cursor(dictionary=True)
+    # Una fila de más para saber si hay página siguiente sin hacer COUNT(*)
+    cur.execute(sql, params + [limite + 1])
+    rows = cur.fetchall()
+    cur.close()
+
+    siguiente = None
+    if len(rows) > limite:
+        rows = rows[:limite]
+        siguiente = codificar_cursor(rows[-1][sort], rows[-1][pk])
+    estados = [r.pop("_estado") for r in rows]
+    return {"cols": nombres, "pk": pk, "sort": sort, "rows": rows, "estados": estados, "next": siguiente}
+
+
+def fila_json(r):
+    # Fechas y decimales como texto, igual que se ven en la tabla HTML
+    return {k: v if v is None or isinstance(v, (int, float, str)) else str(v) for k, v in r.items()}
+
+
+def args_pagina():
+    return {
+        "sort": request.args.get("sort", ""),
+        "desc": request.args.get("dir") == "desc",
+        "estado": request.args.get("estado", ""),
+        "q": request.args.get("q", "").strip(),
+        "cursor": request.args.get("after", ""),
+        "limite": request.args.get("limit", PAGE_SIZE, type=int),
+    }
 
 
 @app.route("/", methods=["GET", "POST"])
 def formulario():
-    cols = [c for c in get_columnas() if not es_excluida(c)]
+    esquema = get_esquema()
     msg = ""
 
     if request.method == "POST":
         try:
-            campos = []
-            placeholders = []
             valores = []
-
-            for c in cols:
-                nombre = c["COLUMN_NAME"]
-                campos.append(nombre)
-                placeholders.append("%s")
-
- 
-                if "tinyint" in c["COLUMN_TYPE"].lower():
+            for nombre, checkbox in zip(esquema["campos"], esquema["checkbox"]):
+                if checkbox:
                     valores.append(1 if request.form.get(nombre) == "on" else 0)
                 else:
                     valores.append(request.form.get(nombre, "") or None)
 
-            sql = f"INSERT INTO inscripciones ({','.join(campos)}) VALUES ({','.join(placeholders)})"
-
-            con = conectar()
+            con = get_db()
             cur = con.cursor()
-            cur.execute(sql, valores)
+            cur.execute(esquema["insert_sql"], valores)
             con.commit()
             cur.close()
-            con.close()
 
             msg = " Guardado"
+        except mysql.connector.Error as e:
+            invalidar_esquema()  # p. ej. una columna renombrada: el siguiente intento relee la tabla
+            msg = f" Error: {e}"
         except Exception as e:
             msg = f" Error: {e}"
 
@@ -123,28 +575,13 @@ def formulario():
         {% if msg %}<p>{{msg}}</p>{% endif %}
 
         <form method="post">
-          {% for c in cols %}
-            <div class="row">
-              <label>Introduce {{c.COLUMN_NAME}}</label>
-              {% if c.COLUMN_COMMENT %}
-                <div style="font-size:.85em;color:#666;">{{c.COLUMN_COMMENT}}</div>
-              {% endif %}
-
-              {% if "tinyint" in c.COLUMN_TYPE.lower() %}
-                <input type="checkbox" name="{{c.COLUMN_NAME}}">
-              {% elif "text" in c.COLUMN_TYPE.lower() %}
-                <textarea name="{{c.COLUMN_NAME}}"></textarea>
-              {% else %}
-                <input type="text" name="{{c.COLUMN_NAME}}">
-              {% endif %}
-            </div>
-          {% endfor %}
+          {{ campos|safe }}
           <button type="submit">Enviar</button>
         </form>
       </div>
     </body></html>
     """
-    return render_template_string(html, cols=cols, msg=msg)
+    return render_template_string(html, campos=esquema["form_html"], msg=msg)
 
 
 @app.route("/admin/login", methods=["GET", "POST"])
@@ -189,12 +626,76 @@ def admin_logout():
     return redirect("/admin/login")
 
 
+@app.route("/admin/esquema", methods=["POST"])
+def admin_esquema():
+    if not session.get("admin"):
+        return redirect("/admin/login")
+    get_esquema(forzar=True)
+    return redirect("/admin")
+
+
+@app.route("/admin/pool")
+def admin_pool():
+    if not session.get("admin"):
+        return redirect("/admin/login")
+    return jsonify(pool.metricas())
+
+
+@app.route("/admin/datos")
+def admin_datos():
+    if not session.get("admin"):
+        return jsonify({"error": "no autorizado"}), 401
+    pagina = leer_pagina(**args_pagina())
+    return jsonify({
+        "cols": pagina["cols"],
+        "pk": pagina["pk"],
+        "rows": [dict(fila_json(r), _estado=e) for r, e in zip(pagina["rows"], pagina["estados"])],
+        "next": pagina["next"],
+    })
+
+
+@app.route("/admin/estados")
+def admin_estados():
+    if not session.get("admin"):
+        return jsonify({"error": "no autorizado"}), 401
+    return jsonify(contar_estados())
+
+
+@app.route("/admin/estado", methods=["POST"])
+def admin_estado():
+    # Cambio de una fila desde el panel sin recargar la página
+    if not session.get("admin"):
+        return jsonify({"error": "no autorizado"}), 401
+    datos = request.get_json(silent=True) or request.form
+    rid = datos.get("rid")
+    estado = datos.get("estado")
+    if not rid or estado not in ESTADOS:
+        return jsonify({"error": "rid o estado no válido"}), 400
+    validos = rids_validos([rid])
+    if not validos:
+        return jsonify({"error": f"no existe ninguna inscripción con rid {rid}"}), 400
+    guardar_estados([(validos[0], estado)])
+    return jsonify({"rid": validos[0], "estado": estado})
+
+
+@app.route("/admin/estado/masivo", methods=["POST"])
+def admin_estado_masivo():
+    if not session.get("admin"):
+        return redirect("/admin/login")
+    estado = request.form.get("estado")
+    rids = request.form.getlist("rids")
+    if rids and estado in ESTADOS:
+        validos = rids_validos(rids)
+        if validos:
+            guardar_estados([(rid, estado) for rid in validos])
+    return redirect(request.referrer or "/admin")
+
+
 @app.route("/admin", methods=["GET", "POST"])
 def admin():
     if not session.get("admin"):
         return redirect("/admin/login")
 
-    crear_tabla_crm_si_no_existe()
     pk = get_pk()
     if not pk:
         return " No se encontró PK en la tabla 'inscripciones'. Debe tener PRIMARY KEY."
@@ -202,32 +703,15 @@ def admin():
     if request.method == "POST":
         rid = request.form.get("rid")
         estado = request.form.get("estado")
-        if rid and estado:
-            rid = str(rid)
-            con = conectar()
-            cur = con.cursor()
-            cur.execute("""
-                INSERT INTO crm_estados_inscripciones (id_registro, estado)
-                VALUES (%s, %s)
-                ON DUPLICATE KEY UPDATE estado=%s
-            """, (rid, estado, estado))
-            con.commit()
-            cur.close()
-            con.close()
-        return redirect("/admin")
+        validos = rids_validos([rid]) if rid and estado in ESTADOS else []
+        if validos:
+            guardar_estados([(validos[0], estado)])
+        # Vuelve a la misma página/filtro desde la que se cambió el estado
+        return redirect(request.full_path.rstrip("?"))
 
-    con = conectar()
-    cur = con.cursor(dictionary=True)
-
-    cur.execute("SELECT id_registro, estado FROM crm_estados_inscripciones")
-    crm = {str(r["id_registro"]): r["estado"] for r in cur.fetchall()}
-
-    cur.execute("SELECT * FROM inscripciones")
-    rows = cur.fetchall()
-    cur.close()
-    con.close()
-
-    cols = list(rows[0].keys()) if rows else []
+    args = args_pagina()
+    pagina = leer_pagina(**args)
+    cuenta = contar_estados()
 
     html = """
     <html><head><meta charset="utf-8"><title>Admin</title>
@@ -237,41 +721,83 @@ def admin():
       table{width:100%;border-collapse:collapse;font-size:.9em;}
       th,td{padding:8px;border-bottom:1px solid #eee;text-align:left;}
       th{color:crimson;}
-      select{padding:6px;border:1px solid #ddd;border-radius:6px;}
+      select,input{padding:6px;border:1px solid #ddd;border-radius:6px;}
       button{background:crimson;color:white;border:none;padding:6px 10px;border-radius:6px;cursor:pointer;}
       a{color:crimson;text-decoration:none;}
       .top{display:flex;justify-content:space-between;align-items:center;}
+      .filtros{display:flex;gap:6px;margin:15px 0;}
+      .resumen{display:flex;gap:8px;flex-wrap:wrap;margin-top:15px;}
+      .resumen a{background:#f7f7f7;border:1px solid #eee;border-radius:6px;padding:6px 10px;}
+      .resumen a.activo{border-color:crimson;}
+      .masivo{display:flex;gap:6px;align-items:center;margin-bottom:10px;}
     </style>
     </head><body>
       <div class="card">
         <div class="top">
           <h2 style="margin:0;color:crimson;">Panel admin</h2>
-          <div><a href="/">Formulario</a> | <a href="/admin/logout">Salir</a></div>
+          <div>
+            <form method="post" action="/admin/esquema" style="display:inline;">
+              <button title="Vuelve a leer las columnas de inscripciones">Refrescar esquema</button>
+            </form>
+            <a href="/">Formulario</a> | <a href="/admin/logout">Salir</a>
+          </div>
         </div>
 
+        <div class="resumen">
+          {% for e, n in cuenta.items() %}
+            <a href="{{ url_for('admin', estado=e) }}" {% if estado==e %}class="activo"{% endif %}>{{e}}: <b data-estado="{{e}}">{{n}}</b></a>
+          {% endfor %}
+        </div>
+
+        <form method="get" class="filtros">
+          <input type="hidden" name="sort" value="{{sort}}">
+          <input type="hidden" name="dir" value="{{ 'desc' if desc else 'asc' }}">
+          <select name="estado">
+            <option value="">Todos los estados</option>
+            {% for e in estados + ["Sin estado"] %}
+              <option value="{{e}}" {% if estado==e %}selected{% endif %}>{{e}}</option>
+            {% endfor %}
+          </select>
+          <input name="q" value="{{q}}" placeholder="Buscar texto">
+          <button>Filtrar</button>
+        </form>
+
         {% if not rows %}
           <p>No hay registros en inscripciones.</p>
         {% else %}
+        <form id="masivo" method="post" action="/admin/estado/masivo" class="masivo">
+          <span>Seleccionados:</span>
+          <select name="estado">
+            {% for e in estados %}<option value="{{e}}">{{e}}</option>{% endfor %}
+          </select>
+          <button>Aplicar</button>
+        </form>
         <table>
           <thead>
             <tr>
-              {% for c in cols %}<th>{{c}}</th>{% endfor %}
+              <th><input type="checkbox" id="todos" title="Seleccionar todos"></th>
+              {% for c in cols %}
+                <th><a href="{{ url_for('admin', sort=c, dir='desc' if sort==c and not desc else 'asc', estado=estado, q=q) }}">
+                  {{c}}{% if sort==c %} {{ '▼' if desc else '▲' }}{% endif %}</a></th>
+              {% endfor %}
               <th>Estado</th>
               <th>Cambiar</th>
             </tr>
           </thead>
-          <tbody>
+          <tbody id="filas">
             {% for r in rows %}
               {% set rid = r[pk] %}
+              {% set actual = crm[loop.index0] %}
               <tr>
+                <td><input type="checkbox" name="rids" value="{{rid}}" form="masivo"></td>
                 {% for c in cols %}<td>{{r[c]}}</td>{% endfor %}
-                <td>{{ crm.get(rid|string, "Sin estado") }}</td>
+                <td class="estado">{{ actual or "Sin estado" }}</td>
                 <td>
-                  <form method="post" style="display:flex;gap:6px;align-items:center;">
+                  <form method="post" class="fila" style="display:flex;gap:6px;align-items:center;">
                     <input type="hidden" name="rid" value="{{rid}}">
                     <select name="estado">
                       {% for e in estados %}
-                        <option value="{{e}}" {% if crm.get(rid|string)==e %}selected{% endif %}>{{e}}</option>
+                        <option value="{{e}}" {% if actual==e %}selected{% endif %}>{{e}}</option>
                       {% endfor %}
                     </select>
                     <button>Guardar</button>
@@ -281,12 +807,86 @@ def admin():
             {% endfor %}
           </tbody>
         </table>
+        {% if next %}
+          <p><button id="mas" data-next="{{next}}">Cargar más</button></p>
+        {% endif %}
         {% endif %}
       </div>
+
+      <script>
+        // Páginas siguientes desde /admin/datos, con los mismos filtros y orden
+        const ESTADOS = {{ estados|tojson }};
+        const filas = document.getElementById("filas");
+
+        // Guardar de cada fila por AJAX; sin JavaScript el formulario hace POST a /admin
+        if (filas) filas.addEventListener("submit", async (ev) => {
+          if (!ev.target.classList.contains("fila")) return;
+          ev.preventDefault();
+          const form = ev.target;
+          const resp = await fetch("/admin/estado", {method: "POST", body: new FormData(form)});
+          if (!resp.ok) { alert("No se pudo guardar el estado"); return; }
+          form.closest("tr").querySelector(".estado").textContent = form.estado.value;
+          const cuenta = await (await fetch("/admin/estados")).json();
+          for (const b of document.querySelectorAll(".resumen b")) b.textContent = cuenta[b.dataset.estado] ?? 0;
+        });
+
+        const todos = document.getElementById("todos");
+        if (todos) todos.addEventListener("change", () => {
+          for (const c of document.querySelectorAll("input[name=rids]")) c.checked = todos.checked;
+        });
+
+        const mas = document.getElementById("mas");
+        if (mas) mas.addEventListener("click", async () => {
+          const params = new URLSearchParams(location.search);
+          params.set("after", mas.dataset.next);
+          mas.disabled = true;
+          const datos = await (await fetch("/admin/datos?" + params)).json();
+          for (const r of datos.rows) {
+            const tr = document.createElement("tr");
+            const marca = document.createElement("input");
+            marca.type = "checkbox"; marca.name = "rids"; marca.value = r[datos.pk];
+            marca.setAttribute("form", "masivo");
+            const celdaMarca = document.createElement("td");
+            celdaMarca.appendChild(marca);
+            tr.appendChild(celdaMarca);
+            for (const c of datos.cols) {
+              const td = document.createElement("td");
+              td.textContent = r[c] === null ? "None" : r[c];
+              tr.appendChild(td);
+            }
+            const td = document.createElement("td");
+            td.textContent = r._estado || "Sin estado";
+            td.className = "estado";
+            tr.appendChild(td);
+            const form = document.createElement("form");
+            form.method = "post";
+            form.className = "fila";
+            form.style.cssText = "display:flex;gap:6px;align-items:center;";
+            const rid = document.createElement("input");
+            rid.type = "hidden"; rid.name = "rid"; rid.value = r[datos.pk];
+            const sel = document.createElement("select");
+            sel.name = "estado";
+            for (const e of ESTADOS) sel.add(new Option(e, e, false, r._estado === e));
+            const btn = document.createElement("button");
+            btn.textContent = "Guardar";
+            form.append(rid, sel, btn);
+            const celda = document.createElement("td");
+            celda.appendChild(form);
+            tr.appendChild(celda);
+            filas.appendChild(tr);
+          }
+          if (datos.next) { mas.dataset.next = datos.next; mas.disabled = false; }
+          else mas.remove();
+        });
+      </script>
     </body></html>
     """
-    return render_template_string(html, rows=rows, cols=cols, pk=pk, crm=crm, estados=ESTADOS)
+    return render_template_string(
+        html, rows=pagina["rows"], cols=pagina["cols"], pk=pk, crm=pagina["estados"], estados=ESTADOS,
+        cuenta=cuenta, next=pagina["next"], sort=pagina["sort"], desc=args["desc"], estado=args["estado"], q=args["q"],
+    )
 
 
 if __name__ == "__main__":
+    preparar_bd()
     app.run(debug=True)
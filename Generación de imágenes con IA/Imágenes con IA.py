@@ -2,30 +2,72 @@
 
 from __future__ import annotations
 
+import argparse
+import hashlib
 import json
+import multiprocessing as mp
+import os
+import queue
 import re
-from dataclasses import dataclass
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field, replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 import xml.etree.ElementTree as ET
 
+from typing import TYPE_CHECKING
+
 import requests
-import torch
-from diffusers import StableDiffusionPipeline
+
+# torch y diffusers se importan al renderizar: si hay un daemon con el pipeline
+# cargado (--serve), el CLI no paga ni la importación ni from_pretrained
+if TYPE_CHECKING:
+    import torch
+    from diffusers import StableDiffusionPipeline
 
 
 XML_IN = Path("producto.xml")
 XML_OUT = Path("producto.updated.xml")
 OUT_DIR = Path("generated_images")
+CACHE_DIR = OUT_DIR / "cache"  # renders direccionados por contenido: <sha256>.png
+RENDER_MANIFEST = OUT_DIR / "manifest.json"  # nodos <image> de cada XML -> entrada de la caché
+CACHE_MAX_MB: float | None = None  # None = sin límite de tamaño
 
 OLLAMA_URL = "http://127.0.0.1:11434/api/generate"
 OLLAMA_MODEL = "llama3:latest"
 OLLAMA_TIMEOUT = 300
+PROMPT_CACHE = Path("prompt_cache.json")  # prompts de SD ya generados, por contexto + imagen
 
-MODEL_ID = "runwayml/stable-diffusion-v1-5"
+MODEL_ID = os.environ.get("SD_MODEL_ID", "runwayml/stable-diffusion-v1-5")  # ruta local o id del Hub
 STEPS = 30
 GUIDANCE = 7.5
 WIDTH, HEIGHT = 1024, 576
 SEED_BASE = 12345
+BATCH_SIZE = 1  # imágenes por llamada a pipe(); >1 aprovecha mejor la CPU/GPU
+PROCS = 1  # procesos de render en CPU (cada uno con su propia copia del pipeline)
+PROMPT_GROUP = 0  # imágenes por llamada al LLM en el pipeline solapado (0 = todo el producto de una vez)
+PIPELINE_QUEUE = 8  # grupos de trabajos esperando render como máximo
+
+# Previews: pocos pasos con un scheduler rápido y a media resolución, misma semilla que el final
+PREVIEW_STEPS = 8
+PREVIEW_SCALE = 2  # 1024x576 -> 512x288
+PREVIEW_SCHEDULER = "dpm"
+SCHEDULERS = {
+    "dpm": "DPMSolverMultistepScheduler",
+    "euler_a": "EulerAncestralDiscreteScheduler",
+}
+
+# Variantes web de cada render final (srcset): anchos y formato -> calidad, en orden de preferencia
+VARIANT_WIDTHS = (480, 768, 1024)
+VARIANT_FORMATS = {"avif": 50, "webp": 80, "jpeg": 82}
+VARIANT_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+MIME_TYPES = {"avif": "image/avif", "webp": "image/webp", "jpeg": "image/jpeg"}
+
+DAEMON_URL = "http://127.0.0.1:7861"  # daemon de render (--serve); el CLI lo usa si responde
+DAEMON_TIMEOUT = 3600
 
 
 
@@ -37,6 +79,48 @@ class ImgNode:
     src: str
 
 
+@dataclass
+class RenderJob:
+    idx: int
+    im: ImgNode | None  # None cuando el trabajo viaja a otro proceso (no se serializa el XML)
+    prompt: str
+    negative_prompt: str
+    out_path: Path
+    width: int = WIDTH
+    height: int = HEIGHT
+    steps: int = STEPS
+    guidance: float = GUIDANCE
+    scheduler: str = ""  # "" = el del modelo
+    scale: int = 1  # divisor de resolución respecto al render final (previews)
+
+    @property
+    def seed(self) -> int:
+        return SEED_BASE + self.idx
+
+    @property
+    def key(self) -> str:
+        # Todo lo que cambia los píxeles; sección y alt no entran, así dos productos comparten render
+        parts = [MODEL_ID, self.prompt, self.negative_prompt, self.seed,
+                 self.steps, self.guidance, self.width, self.height]
+        if self.scheduler or self.scale != 1:
+            parts += [self.scheduler, self.scale]  # las claves de renders normales no cambian
+        raw = json.dumps(parts, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def params(self) -> dict:
+        return {
+            "model": MODEL_ID, "seed": self.seed, "steps": self.steps, "guidance": self.guidance,
+            "width": self.width, "height": self.height, "scheduler": self.scheduler or "default",
+        }
+
+    @property
+    def preview(self) -> bool:
+        return self.scale != 1
+
+    def detached(self) -> "RenderJob":
+        return replace(self, im=None)
+
+
 _slug_rx = re.compile(r"[^\w\s-]", flags=re.UNICODE)
 _space_rx = re.compile(r"[\s_-]+")
 
@@ -123,21 +207,58 @@ def build_context(root: ET.Element) -> dict:
         },
     }
 
-def detect_section(root: ET.Element, src: str) -> str:
+TAG_SECTIONS = {base[2:]: section for section, base in SECTION_PATHS.items()}  # "keyFeatures" -> "features"
 
-    for section, base in SECTION_PATHS.items():
-        if root.find(f"{base}//image[@src='{src}']") is not None:
-            return section
-    return "section"
+def image_node(el: ET.Element, section: str) -> ImgNode:
+    src = (el.get("src") or "").strip()
+    alt = (el.get("alt") or "").strip() or "image"
+    return ImgNode(el=el, section=section, alt=alt, src=src)
 
 def gather_images(root: ET.Element) -> list[ImgNode]:
+    # La sección es el hijo directo del producto que contiene la imagen: una sola pasada
     out: list[ImgNode] = []
-    for el in root.findall(".//image"):
-        src = (el.get("src") or "").strip()
-        alt = (el.get("alt") or "").strip() or "image"
-        out.append(ImgNode(el=el, section=detect_section(root, src), alt=alt, src=src))
+    for child in root:
+        section = TAG_SECTIONS.get(child.tag, "section")
+        out.extend(image_node(el, section) for el in child.iter("image"))
     return out
 
+def iter_products(path: Path):
+    """
+    Recorre un XML con iterparse y devuelve (producto, imágenes, es_raíz) cada vez
+    que se cierra un <product>, ya sea la raíz del fichero o un hijo de un feed
+    con muchos productos. La sección de cada imagen se anota en la misma pasada
+    y los productos ya procesados se sueltan del árbol, así la memoria no crece
+    con el tamaño del catálogo.
+    """
+    depth = 0
+    root: ET.Element | None = None
+    product_depth: int | None = None
+    section = "section"
+    imgs: list[ImgNode] = []
+
+    for event, el in ET.iterparse(str(path), events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if root is None:
+                root = el
+            if product_depth is None and el.tag == "product" and depth <= 2:
+                product_depth, imgs = depth, []
+            elif product_depth is not None and depth == product_depth + 1:
+                section = TAG_SECTIONS.get(el.tag, "section")
+            continue
+
+        d, depth = depth, depth - 1
+        if product_depth is not None and d > product_depth:
+            if el.tag == "image":
+                imgs.append(image_node(el, section))
+        elif product_depth is not None and d == product_depth:
+            yield el, imgs, el is root
+            product_depth = None
+            if el is not root:
+                root.remove(el)
+        elif d == 2 and root is not None:
+            root.remove(el)  # nodos del feed que no son productos
+
 
 
 def get_prompts(context: dict, imgs: list[ImgNode]) -> list[dict]:
@@ -168,14 +289,143 @@ def get_prompts(context: dict, imgs: list[ImgNode]) -> list[dict]:
     prompts = []
     for i in range(1, len(imgs) + 1):
         x = items.get(i, {})
-        p = (x.get("prompt") or "").strip() or "premium minimal SaaS edtech concept, soft light, clean composition, ultra detailed"
-        n = (x.get("negative_prompt") or "").strip() or "text, letters, words, watermark, logo, brand, blurry, low quality, artifacts"
-        prompts.append({"prompt": p, "negative_prompt": n})
+        p = (x.get("prompt") or "").strip()
+        n = (x.get("negative_prompt") or "").strip()
+        prompts.append({
+            "prompt": p or "premium minimal SaaS edtech concept, soft light, clean composition, ultra detailed",
+            "negative_prompt": n or "text, letters, words, watermark, logo, brand, blurry, low quality, artifacts",
+            "fallback": not p,  # el modelo no devolvió prompt para esta imagen
+        })
     return prompts
 
 
+# Partes de build_context que afectan a cada sección: editar una de ellas
+# solo invalida los prompts de las imágenes de esa sección.
+SECTION_CONTEXT_KEYS = {
+    "hero": ("valueProposition", "subtitle"),
+    "problem": ("problems",),
+    "benefits": ("benefits",),
+    "features": ("features",),
+}
+GLOBAL_CONTEXT_KEYS = ("slug", "title", "category", "style")
+
+
+def prompt_key(context: dict, im: ImgNode) -> str:
+    keys = GLOBAL_CONTEXT_KEYS + SECTION_CONTEXT_KEYS.get(im.section, ())
+    scoped = {k: context.get(k) for k in keys}
+    blob = json.dumps(
+        {"model": OLLAMA_MODEL, "context": scoped, "section": im.section, "alt": im.alt, "src": im.src},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def load_prompt_cache(path: Path = PROMPT_CACHE) -> dict:
+    if not path.is_file():
+        return {}
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+
+
+def save_prompt_cache(cache: dict, path: Path = PROMPT_CACHE) -> None:
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(cache, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp.replace(path)
+
+
+class PromptCache:
+    """
+    Cache de prompts en memoria durante toda la ejecución: el JSON se lee una vez
+    y se reescribe una vez en flush(). Cada prompt nuevo se añade además a un
+    diario JSONL (una línea), así una ejecución interrumpida no pierde llamadas
+    al LLM y el coste de escritura no crece con el tamaño de la cache.
+    """
+
+    def __init__(self, path: Path = PROMPT_CACHE):
+        self.path = path
+        self.journal = path.with_suffix(path.suffix + ".log")
+        self.entries = load_prompt_cache(path)
+        self.dirty = False
+        self._lock = threading.Lock()
+        if self.journal.is_file():
+            for line in self.journal.read_text(encoding="utf-8").splitlines():
+                try:
+                    key, entry = json.loads(line)
+                except ValueError:
+                    continue  # última línea a medias de una ejecución interrumpida
+                self.entries[key] = entry
+                self.dirty = True
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def __getitem__(self, key: str) -> dict:
+        return self.entries[key]
+
+    def add(self, key: str, entry: dict) -> None:
+        with self._lock:
+            self.entries[key] = entry
+            with self.journal.open("a", encoding="utf-8") as f:
+                f.write(json.dumps([key, entry], ensure_ascii=False) + "\n")
+            self.dirty = True
+
+    def missing(self, context: dict, imgs: list[ImgNode]) -> bool:
+        return any(prompt_key(context, im) not in self.entries for im in imgs)
+
+    def flush(self) -> None:
+        with self._lock:
+            if self.dirty:
+                save_prompt_cache(self.entries, self.path)
+                self.journal.unlink(missing_ok=True)
+                self.dirty = False
+
+
+def cached_prompts(context: dict, imgs: list[ImgNode], cache: PromptCache | None = None) -> list[dict]:
+    """
+    get_prompts con cache en disco: solo se pide al LLM lo que no está en
+    cache, en una única llamada. Los prompts de reserva (cuando el modelo
+    no devuelve uno) no se guardan, así que se reintentan en la siguiente.
+    Sin `cache` se abre y se vuelca una solo para esta llamada.
+    """
+    own = cache is None
+    if own:
+        cache = PromptCache()
+    keys = [prompt_key(context, im) for im in imgs]
+    missing = [i for i, k in enumerate(keys) if k not in cache]
+
+    fresh: dict[int, dict] = {}
+    if missing:
+        for i, pr in zip(missing, get_prompts(context, [imgs[i] for i in missing])):
+            fresh[i] = pr
+            if not pr.get("fallback"):
+                im = imgs[i]
+                cache.add(keys[i], {
+                    "prompt": pr["prompt"],
+                    "negative_prompt": pr["negative_prompt"],
+                    "section": im.section,
+                    "alt": im.alt,
+                    "src": im.src,
+                    "model": OLLAMA_MODEL,
+                })
+    if own:
+        cache.flush()
+
+    llamadas = "1 llamada" if missing else "ninguna llamada"
+    print(f"Prompts: {len(imgs) - len(missing)} desde cache, {len(missing)} nuevos ({llamadas} al LLM)")
+    return [
+        fresh[i] if i in fresh else {"prompt": cache[k]["prompt"], "negative_prompt": cache[k]["negative_prompt"]}
+        for i, k in enumerate(keys)
+    ]
+
+
 
 def load_sd() -> StableDiffusionPipeline:
+    import torch
+    from diffusers import StableDiffusionPipeline
+
     device = "cuda" if torch.cuda.is_available() else "cpu"
     dtype = torch.float16 if device == "cuda" else torch.float32
 
@@ -193,51 +443,957 @@ def load_sd() -> StableDiffusionPipeline:
 
     return pipe
 
-def render_all(pipe: StableDiffusionPipeline, imgs: list[ImgNode], prompts: list[dict]) -> None:
-    OUT_DIR.mkdir(parents=True, exist_ok=True)
-
-    for idx, (im, pr) in enumerate(zip(imgs, prompts), start=1):
-        fname = safe_name(im.section, im.alt)
-        out_path = OUT_DIR / fname
-
-        if not out_path.exists():
-            g = torch.Generator(device=pipe.device.type).manual_seed(SEED_BASE + idx)
-            res = pipe(
-                prompt=pr["prompt"],
-                negative_prompt=pr["negative_prompt"],
-                num_inference_steps=STEPS,
-                guidance_scale=GUIDANCE,
-                width=WIDTH,
-                height=HEIGHT,
-                generator=g,
+def use_scheduler(pipe: StableDiffusionPipeline, name: str) -> None:
+    import diffusers
+
+    # El scheduler original se guarda la primera vez para poder volver a él
+    if not hasattr(pipe, "_base_scheduler"):
+        pipe._base_scheduler = pipe.scheduler
+    base = pipe._base_scheduler
+    pipe.scheduler = getattr(diffusers, SCHEDULERS[name]).from_config(base.config) if name else base
+
+
+def noise_latents(job: RenderJob, device: torch.device, dtype: torch.dtype) -> torch.Tensor:
+    """
+    Ruido inicial de la semilla al tamaño del render final. Se genera en el
+    dispositivo y dtype del pipeline, igual que hace diffusers con generator=,
+    para que una clave de la caché siga dando los mismos píxeles en CUDA. Un
+    preview usa ese mismo ruido reducido por bloques, así su composición anticipa
+    la del render final. Promocionar no reutiliza nada del preview: se renderiza
+    de cero desde este mismo ruido (generarlo cuesta poco frente a los pasos).
+    """
+    import torch
+
+    w, h = job.width * job.scale, job.height * job.scale
+    gen = torch.Generator(device=device.type).manual_seed(job.seed)
+    noise = torch.randn((1, 4, h // 8, w // 8), generator=gen, device=gen.device, dtype=dtype)
+    if job.scale > 1:
+        # La media de scale² muestras N(0,1) tiene desviación 1/scale: se reescala
+        noise = torch.nn.functional.avg_pool2d(noise, job.scale) * job.scale
+    return noise
+
+
+def render_batch(pipe: StableDiffusionPipeline, jobs: list[RenderJob]) -> None:
+    import torch
+
+    # Cada imagen conserva su propio generador (SEED_BASE + idx), igual que en modo individual
+    first = jobs[0]
+    use_scheduler(pipe, first.scheduler)
+    gens = [torch.Generator(device=pipe.device.type).manual_seed(j.seed) for j in jobs]
+    latents = torch.cat([noise_latents(j, pipe.device, pipe.unet.dtype) for j in jobs]).to(pipe.device)
+    res = pipe(
+        prompt=[j.prompt for j in jobs],
+        negative_prompt=[j.negative_prompt for j in jobs],
+        num_inference_steps=first.steps,
+        guidance_scale=first.guidance,
+        width=first.width,
+        height=first.height,
+        generator=gens if len(gens) > 1 else gens[0],
+        latents=latents,
+    )
+    for j, img in zip(jobs, res.images):
+        # Escritura atómica: un .png a medias en la caché se tomaría por un render válido
+        tmp = j.out_path.with_name(f"{j.out_path.stem}.part{j.out_path.suffix}")
+        img.save(tmp)
+        os.replace(tmp, j.out_path)
+
+
+def plan_jobs(
+    imgs: list[ImgNode], prompts: list[dict], cache_dir: Path = CACHE_DIR, start: int = 1,
+) -> list[RenderJob]:
+    # `start` es la posición de imgs[0] en el producto: la semilla no depende de cómo se agrupe
+    jobs = []
+    for idx, (im, pr) in enumerate(zip(imgs, prompts), start=start):
+        j = RenderJob(
+            idx=idx,
+            im=im,
+            prompt=pr["prompt"],
+            negative_prompt=pr["negative_prompt"],
+            out_path=cache_dir,
+        )
+        j.out_path = cache_dir / f"{j.key}.png"
+        jobs.append(j)
+    return jobs
+
+
+def preview_jobs(jobs: list[RenderJob], cache_dir: Path = CACHE_DIR) -> list[RenderJob]:
+    """Versión barata de cada trabajo: misma semilla y prompt, menos pasos y resolución."""
+    out = []
+    for j in jobs:
+        p = replace(
+            j,
+            width=j.width // PREVIEW_SCALE // 8 * 8,
+            height=j.height // PREVIEW_SCALE // 8 * 8,
+            steps=PREVIEW_STEPS,
+            scheduler=PREVIEW_SCHEDULER,
+            scale=PREVIEW_SCALE,
+        )
+        p.out_path = cache_dir / "preview" / f"{p.key}.png"
+        out.append(p)
+    return out
+
+
+def pending_jobs(jobs: list[RenderJob]) -> list[RenderJob]:
+    """Trabajos sin entrada en la caché, uno por clave (peticiones idénticas se renderizan una vez)."""
+    seen: set[Path] = set()
+    pending = []
+    for j in jobs:
+        if j.out_path in seen or j.out_path.exists():
+            continue
+        seen.add(j.out_path)
+        j.out_path.parent.mkdir(parents=True, exist_ok=True)
+        pending.append(j)
+    return pending
+
+
+def apply_srcs(jobs: list[RenderJob]) -> None:
+    for j in jobs:
+        if j.im is not None and j.out_path.exists():
+            j.im.el.set("src", str(j.out_path))
+
+
+def render_jobs(pipe: StableDiffusionPipeline, jobs: list[RenderJob], batch_size: int = BATCH_SIZE) -> float:
+    """Renderiza en este proceso los trabajos que no están en la caché. Devuelve img/s."""
+    # Solo se agrupan imágenes que comparten resolución, pasos y guidance
+    groups: dict[tuple, list[RenderJob]] = {}
+    for j in pending_jobs(jobs):
+        groups.setdefault((j.width, j.height, j.steps, j.guidance, j.scheduler), []).append(j)
+
+    timings: dict[int, list[float]] = {}  # tamaño de lote -> [imágenes, segundos]
+    for group in groups.values():
+        for i in range(0, len(group), max(1, batch_size)):
+            chunk = group[i:i + max(1, batch_size)]
+            t0 = time.perf_counter()
+            render_batch(pipe, chunk)
+            dt = time.perf_counter() - t0
+            acc = timings.setdefault(len(chunk), [0, 0.0])
+            acc[0] += len(chunk)
+            acc[1] += dt
+            print(f"  lote de {len(chunk)}: {dt:.1f}s ({len(chunk) / dt:.2f} img/s)")
+
+    for size, (n, secs) in sorted(timings.items()):
+        print(f"Lotes de {size}: {n} imágenes en {secs:.1f}s -> {n / secs:.3f} img/s")
+
+    total_n = sum(n for n, _ in timings.values())
+    total_s = sum(secs for _, secs in timings.values())
+    return total_n / total_s if total_s else 0.0
+
+
+def render_all(
+    pipe: StableDiffusionPipeline,
+    imgs: list[ImgNode],
+    prompts: list[dict],
+    batch_size: int = BATCH_SIZE,
+    cache_dir: Path = CACHE_DIR,
+    preview: bool = False,
+) -> None:
+    jobs = plan_jobs(imgs, prompts, cache_dir)
+    if preview:
+        jobs = preview_jobs(jobs, cache_dir)
+    render_jobs(pipe, jobs, batch_size=batch_size)
+    apply_srcs(jobs)
+
+
+
+def farm_worker(wid: int, threads: int, cores: list[int] | None, jobs_q, results_q) -> None:
+    import torch
+
+    # Cada proceso fija sus hilos (y sus núcleos si el SO lo permite) antes de cargar el modelo
+    if cores and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, cores)
+        except OSError:
+            pass
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+    t0 = time.perf_counter()
+    try:
+        pipe = load_sd()
+    except Exception as e:
+        results_q.put(("load_error", wid, None, f"load_sd: {e!r}"))
+        return
+    results_q.put(("ready", wid, None, time.perf_counter() - t0))
+
+    while True:
+        job = jobs_q.get()
+        if job is None:
+            break
+        t0 = time.perf_counter()
+        try:
+            render_batch(pipe, [job])
+            results_q.put(("done", wid, str(job.out_path), time.perf_counter() - t0))
+        except Exception as e:
+            results_q.put(("error", wid, str(job.out_path), repr(e)))
+
+
+def render_farm(jobs: list[RenderJob], procs: int, threads: int | None = None) -> float:
+    """
+    Reparte los trabajos pendientes (de todos los XML) entre `procs` procesos
+    que cargan el pipeline una sola vez. Devuelve el throughput agregado
+    (img/s, sin contar la carga del modelo).
+    """
+    pending = [j.detached() for j in pending_jobs(jobs)]
+    if not pending:
+        print("Render farm: nada pendiente.")
+        return 0.0
+
+    procs = max(1, min(procs, len(pending)))
+    n_cpu = os.cpu_count() or 1
+    threads = threads or max(1, n_cpu // procs)
+
+    ctx = mp.get_context("spawn")  # fork + torch con hilos ya creados no es fiable
+    jobs_q = ctx.Queue()
+    results_q = ctx.Queue()
+    for j in pending:
+        jobs_q.put(j)
+    for _ in range(procs):
+        jobs_q.put(None)
+
+    workers = []
+    for wid in range(procs):
+        cores = list(range(wid * threads, min(n_cpu, (wid + 1) * threads))) or None
+        w = ctx.Process(target=farm_worker, args=(wid, threads, cores, jobs_q, results_q), daemon=True)
+        w.start()
+        workers.append(w)
+    print(f"Render farm: {procs} procesos × {threads} hilos, {len(pending)} imágenes")
+
+    per_worker: dict[int, list[float]] = {}
+    first_ready: float | None = None
+    done = errors = 0
+    load_failed = 0  # procesos sin pipeline: no consumen trabajos, no cuentan como resultados
+    t_start = time.perf_counter()
+    while done + errors < len(pending):
+        if load_failed == procs:
+            print("Render farm: ningún proceso ha podido cargar el pipeline.")
+            break
+        try:
+            kind, wid, path, value = results_q.get(timeout=5)
+        except queue.Empty:
+            if not any(w.is_alive() for w in workers):
+                print("Render farm: todos los procesos han terminado antes de tiempo.")
+                break
+            continue
+        if kind == "ready":
+            first_ready = first_ready or time.perf_counter()
+            print(f"  [w{wid}] pipeline cargado en {value:.1f}s")
+        elif kind == "load_error":
+            load_failed += 1
+            print(f"  [w{wid}] ERROR {value}; sus trabajos los hacen los demás procesos")
+        elif kind == "done":
+            done += 1
+            acc = per_worker.setdefault(wid, [0, 0.0])
+            acc[0] += 1
+            acc[1] += value
+            print(f"  [w{wid}] {path} ({value:.1f}s)  {done}/{len(pending)}")
+        else:
+            errors += 1
+            print(f"  [w{wid}] ERROR {path or ''}: {value}")
+
+    t_end = time.perf_counter()
+    for w in workers:
+        w.join(timeout=10)
+
+    render_s = t_end - (first_ready or t_start)
+    agg = done / render_s if render_s > 0 else 0.0
+    for wid, (n, secs) in sorted(per_worker.items()):
+        print(f"  w{wid}: {n} imágenes, {n / secs:.3f} img/s")
+    print(
+        f"Render farm: {done} ok / {errors} errores ({load_failed} procesos sin cargar) en {t_end - t_start:.1f}s "
+        f"(render {render_s:.1f}s) -> {agg:.3f} img/s agregados"
+    )
+    return agg
+
+
+def baseline_ips(jobs: list[RenderJob], n: int) -> float:
+    """Mide img/s del camino de un solo proceso con `n` trabajos en un directorio temporal."""
+    sample = [j.detached() for j in jobs[:n]]
+    if not sample:
+        return 0.0
+    with tempfile.TemporaryDirectory(prefix="sd-baseline-") as tmp:
+        for j in sample:
+            j.out_path = Path(tmp) / j.out_path.name
+        pipe = load_sd()
+        import torch
+        print(f"Referencia 1 proceso ({torch.get_num_threads()} hilos), {len(sample)} imágenes:")
+        return render_jobs(pipe, sample, batch_size=1)
+
+
+def cold_load() -> tuple[StableDiffusionPipeline, float, float]:
+    """Carga el pipeline midiendo por separado la importación de torch/diffusers y from_pretrained."""
+    t0 = time.perf_counter()
+    import torch  # noqa: F401
+    import diffusers  # noqa: F401
+    t1 = time.perf_counter()
+    pipe = load_sd()
+    return pipe, t1 - t0, time.perf_counter() - t1
+
+
+def job_to_dict(j: RenderJob) -> dict:
+    d = asdict(j.detached())
+    d["out_path"] = str(j.out_path.resolve())  # el daemon comprueba que coincide con su caché
+    return d
+
+
+def job_from_dict(d: dict, cache_dir: Path = CACHE_DIR) -> RenderJob:
+    """
+    El daemon decide dónde escribe: siempre <cache_dir>/[preview/]<clave>.png. Una
+    ruta del cliente que no coincida con esa se rechaza en vez de obedecerla.
+    """
+    j = RenderJob(**{**d, "im": None, "out_path": cache_dir})
+    j.out_path = (cache_dir / "preview" if j.preview else cache_dir) / f"{j.key}.png"
+    if d.get("out_path") and Path(d["out_path"]).resolve() != j.out_path.resolve():
+        raise ValueError(f"out_path fuera de la caché del daemon ({cache_dir}): {d['out_path']}")
+    return j
+
+
+def serve(url: str = DAEMON_URL) -> None:
+    """Daemon de render: carga el pipeline una vez y atiende POST /render hasta Ctrl+C."""
+    pipe, import_s, load_s = cold_load()
+    cache_dir = CACHE_DIR.resolve()
+    lock = threading.Lock()  # un solo pipeline: los renders van de uno en uno
+    state = {"model": MODEL_ID, "pid": os.getpid(), "import_s": import_s, "load_s": load_s, "rendered": 0}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args) -> None:
+            pass
+
+        def send_json(self, code: int, obj: dict) -> None:
+            body = json.dumps(obj).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self) -> None:
+            if self.path == "/health":
+                self.send_json(200, state)
+            else:
+                self.send_json(404, {"error": "not found"})
+
+        def do_POST(self) -> None:
+            if self.path != "/render":
+                self.send_json(404, {"error": "not found"})
+                return
+            # Solo JSON: un navegador no puede mandarlo a otro origen sin preflight (que aquí no se atiende)
+            if self.headers.get("Content-Type", "").split(";")[0].strip().lower() != "application/json":
+                self.send_json(415, {"error": "Content-Type debe ser application/json"})
+                return
+            try:
+                req = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+                jobs = [job_from_dict(d, cache_dir) for d in req["jobs"]]
+            except (ValueError, TypeError, KeyError) as e:
+                self.send_json(400, {"error": repr(e)})
+                return
+            try:
+                with lock:
+                    t0 = time.perf_counter()
+                    ips = render_jobs(pipe, jobs, batch_size=int(req.get("batch_size") or BATCH_SIZE))
+                    secs = time.perf_counter() - t0
+                done = [str(j.out_path) for j in jobs if j.out_path.exists()]
+                state["rendered"] += len(done)
+                self.send_json(200, {"ips": ips, "render_s": secs, "done": done})
+            except Exception as e:
+                self.send_json(500, {"error": repr(e)})
+
+    host, port = url.split("//", 1)[-1].rsplit(":", 1)
+    server = ThreadingHTTPServer((host, int(port)), Handler)
+    print(
+        f"Daemon de render en {url} (import {import_s:.1f}s, carga {load_s:.1f}s). Ctrl+C para salir."
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def daemon_alive(url: str) -> bool:
+    try:
+        r = requests.get(f"{url}/health", timeout=1)
+        return r.ok and r.json().get("model") == MODEL_ID
+    except (requests.RequestException, ValueError):
+        return False
+
+
+class Renderer:
+    """
+    Renderiza a través del daemon si hay uno vivo con el mismo modelo; si no (o si
+    falla a mitad), carga el pipeline en este proceso una sola vez. Acumula la
+    latencia de arranque en frío y la del camino caliente por separado.
+    """
+
+    def __init__(self, daemon_url: str | None = DAEMON_URL, batch_size: int = BATCH_SIZE):
+        self.daemon_url = daemon_url if daemon_url and daemon_alive(daemon_url) else None
+        self.batch_size = batch_size
+        self.pipe: StableDiffusionPipeline | None = None
+        self.cold: dict[str, float] = {}
+        self.warm: list[tuple[float, float, int]] = []  # (petición, render, imágenes)
+        self._loader: threading.Thread | None = None
+        self._load_error: BaseException | None = None
+        # preload() llega desde el hilo de prompts y render() desde el principal: sin
+        # este lock los dos podían lanzar su propio from_pretrained
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        try:
+            self.pipe, import_s, load_s = cold_load()
+            self.cold = {"import_s": import_s, "load_s": load_s}
+        except BaseException as e:
+            self._load_error = e
+
+    def preload(self) -> None:
+        """Empieza a cargar el pipeline en segundo plano (no hace nada si hay daemon o ya está)."""
+        with self._lock:
+            if self.daemon_url is None and self.pipe is None and self._loader is None:
+                self._loader = threading.Thread(target=self.load, name="sd-loader", daemon=True)
+                self._loader.start()
+
+    def render(self, jobs: list[RenderJob]) -> float:
+        todo = pending_jobs(jobs)
+        if not todo:
+            return 0.0
+        if self.daemon_url:
+            try:
+                return self.render_remote(todo)
+            except (requests.RequestException, ValueError, KeyError) as e:
+                print(f"Daemon no disponible ({e!r}); se renderiza en este proceso.")
+                self.daemon_url = None
+        with self._lock:
+            if self._loader is not None:
+                self._loader.join()
+                self._loader = None
+            elif self.pipe is None:
+                self.load()
+        if self._load_error is not None:
+            raise self._load_error
+        t0 = time.perf_counter()
+        ips = render_jobs(self.pipe, todo, batch_size=self.batch_size)
+        self.cold["render_s"] = self.cold.get("render_s", 0.0) + time.perf_counter() - t0
+        return ips
+
+    def render_remote(self, jobs: list[RenderJob]) -> float:
+        t0 = time.perf_counter()
+        r = requests.post(
+            f"{self.daemon_url}/render",
+            json={"jobs": [job_to_dict(j) for j in jobs], "batch_size": self.batch_size},
+            timeout=DAEMON_TIMEOUT,
+        )
+        r.raise_for_status()
+        data = r.json()
+        self.warm.append((time.perf_counter() - t0, data["render_s"], len(data["done"])))
+        print(f"  daemon: {len(data['done'])}/{len(jobs)} imágenes en {data['render_s']:.1f}s")
+        return data["ips"]
+
+    def report(self) -> None:
+        if self.cold:
+            print(
+                f"Arranque en frío: import {self.cold['import_s']:.1f}s + carga {self.cold['load_s']:.1f}s, "
+                f"render {self.cold.get('render_s', 0.0):.1f}s"
+            )
+        if self.warm:
+            total = sum(t for t, _, _ in self.warm)
+            render = sum(r for _, r, _ in self.warm)
+            n = sum(k for _, _, k in self.warm)
+            print(
+                f"Camino caliente (daemon): {len(self.warm)} peticiones, {n} imágenes, "
+                f"{total:.1f}s total ({render:.1f}s render, {total - render:.2f}s de sobrecarga)"
+            )
+
+
+def load_render_manifest(path: Path = RENDER_MANIFEST) -> dict:
+    if path.exists():
+        try:
+            man = json.loads(path.read_text(encoding="utf-8"))
+            man.setdefault("entries", {})
+            man.setdefault("nodes", {})
+            man.setdefault("previews", {})
+            return man
+        except ValueError:
+            print(f"Manifiesto de renders ilegible, se reconstruye: {path}")
+    return {"entries": {}, "nodes": {}, "previews": {}}
+
+
+def save_render_manifest(man: dict, path: Path = RENDER_MANIFEST) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    tmp.write_text(json.dumps(man, ensure_ascii=False, indent=1), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def record_renders(man: dict, source: str, jobs: list[RenderJob]) -> None:
+    """
+    Apunta en el manifiesto qué entrada de la caché usa cada <image> del XML y
+    refresca su LRU. Los previews van a "previews" y los finales a "nodes".
+    """
+    now = time.time()
+    nodes = []
+    kind = "preview" if any(j.preview for j in jobs) else "final"
+    for j in jobs:
+        if not j.out_path.exists():
+            continue  # render fallido o no promocionado: el nodo queda sin entrada
+        file = f"preview/{j.out_path.name}" if j.preview else j.out_path.name
+        e = man["entries"].setdefault(
+            j.key, {"file": file, "kind": kind, "created_at": now, "params": j.params()},
+        )
+        e["bytes"] = j.out_path.stat().st_size
+        e["last_used"] = now
+        nodes.append({
+            "index": j.idx,
+            "section": j.im.section if j.im else "",
+            "alt": j.im.alt if j.im else "",
+            "key": j.key,
+        })
+    man["previews" if kind == "preview" else "nodes"][source] = nodes
+
+
+def evict_renders(man: dict, max_mb: float | None, cache_dir: Path = CACHE_DIR) -> int:
+    """
+    Borra por LRU las entradas que ningún XML referencia hasta quedar por debajo
+    de `max_mb`. Las referenciadas no se tocan (romperían el src del XML).
+    """
+    entries = man["entries"]
+    for k in [k for k, e in entries.items() if not (cache_dir / e["file"]).exists()]:
+        del entries[k]
+    if max_mb is None:
+        return 0
+
+    def size(e: dict) -> int:
+        return e.get("bytes", 0) + sum(v["bytes"] for v in e.get("variants", []))
+
+    budget = max_mb * 1024 * 1024
+    total = sum(size(e) for e in entries.values())
+    referenced = {
+        n["key"] for part in ("nodes", "previews") for nodes in man[part].values() for n in nodes
+    }
+    removed = 0
+    candidates = sorted(
+        (k for k in entries if k not in referenced),
+        key=lambda k: entries[k].get("last_used", 0),
+    )
+    for k in candidates:
+        if total <= budget:
+            break
+        e = entries.pop(k)
+        (cache_dir / e["file"]).unlink(missing_ok=True)
+        for v in e.get("variants", []):
+            (cache_dir / "variants" / v["file"]).unlink(missing_ok=True)
+        total -= size(e)
+        removed += 1
+    if total > budget:
+        print(f"Caché de renders: {total / 1e6:.1f} MB en uso por XML, por encima del límite de {max_mb} MB")
+    return removed
+
+
+def variant_formats() -> dict[str, int]:
+    """VARIANT_FORMATS que este Pillow sabe escribir (AVIF necesita Pillow >= 11.3 o pillow-avif-plugin)."""
+    from PIL import Image
+    try:
+        import pillow_avif  # noqa: F401
+    except ImportError:
+        pass
+    Image.init()
+    fmts = {f: q for f, q in VARIANT_FORMATS.items() if f.upper() in Image.SAVE}
+    missing = set(VARIANT_FORMATS) - set(fmts)
+    if missing:
+        print(f"Variantes: este Pillow no escribe {', '.join(sorted(missing))}; se omiten.")
+    return fmts
+
+
+def encode_variants(png: str, key: str, out_dir: str, widths: tuple[int, ...], formats: dict[str, int]) -> list[dict]:
+    """Codifica un render en cada ancho y formato (se ejecuta en el pool de procesos)."""
+    from PIL import Image
+    try:
+        import pillow_avif  # noqa: F401
+    except ImportError:
+        pass
+
+    out = []
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    with Image.open(png) as src:
+        im = src.convert("RGB")
+    for w in sorted({min(w, im.width) for w in widths}):
+        resized = im if w == im.width else im.resize((w, round(im.height * w / im.width)), Image.LANCZOS)
+        for fmt, quality in formats.items():
+            path = Path(out_dir) / f"{key}-{w}.{'jpg' if fmt == 'jpeg' else fmt}"
+            if not path.exists():
+                # Temporal por proceso: otro worker puede estar codificando la misma variante
+                tmp = path.with_name(f"{path.stem}.{os.getpid()}.part{path.suffix}")
+                resized.save(tmp, format=fmt.upper(), quality=quality)
+                os.replace(tmp, path)
+            out.append({"file": path.name, "format": fmt, "width": w, "bytes": path.stat().st_size})
+    return out
+
+
+def apply_variants(jobs: list[RenderJob], man: dict, cache_dir: Path = CACHE_DIR) -> None:
+    """srcset JPEG en el propio <image> y un <source> por formato moderno, como en <picture>."""
+    for j in jobs:
+        if j.im is None:
+            continue
+        el = j.im.el
+        for old in el.findall("source"):
+            el.remove(old)
+        el.attrib.pop("srcset", None)
+        variants = man["entries"].get(j.key, {}).get("variants") or []
+        for fmt in VARIANT_FORMATS:
+            vs = sorted((v for v in variants if v["format"] == fmt), key=lambda v: v["width"])
+            if not vs:
+                continue
+            srcset = ", ".join(f"{cache_dir / 'variants' / v['file']} {v['width']}w" for v in vs)
+            if fmt == "jpeg":
+                el.set("srcset", srcset)
+            else:
+                ET.SubElement(el, "source", {"type": MIME_TYPES[fmt], "srcset": srcset})
+
+
+def variant_savings(jobs: list[RenderJob], man: dict) -> tuple[int, int]:
+    """(bytes de los PNG, bytes de la mejor variante a ancho completo) de las imágenes con variantes."""
+    png = best = 0
+    for key in {j.key for j in jobs}:
+        e = man["entries"].get(key, {})
+        variants = e.get("variants")
+        if not variants:
+            continue
+        top = max(v["width"] for v in variants)
+        png += e.get("bytes", 0)
+        best += min(v["bytes"] for v in variants if v["width"] == top)
+    return png, best
+
+
+def xml_out_for(xml_in: Path, preview: bool = False) -> Path:
+    if preview:
+        return xml_in.with_name(f"{xml_in.stem}.preview.xml")
+    return XML_OUT if xml_in == XML_IN else xml_in.with_name(f"{xml_in.stem}.updated.xml")
+
+
+def select_jobs(
+    jobs: list[RenderJob], preview: bool = False, promote: list[int] | None = None,
+) -> tuple[list[RenderJob], list[RenderJob]]:
+    """
+    Devuelve (trabajos del XML, trabajos a renderizar). En modo preview ambos son
+    los previews; al promocionar solo se renderizan las imágenes aprobadas (índices
+    1..n, todas si la lista está vacía) pero el XML conserva los finales ya hechos.
+    """
+    if preview:
+        jobs = preview_jobs(jobs)
+        return jobs, jobs
+    if promote:
+        wanted = set(promote)
+        return jobs, [j for j in jobs if j.idx in wanted]
+    return jobs, jobs
+
+
+def catalog_files(source: Path) -> list[Path]:
+    if source.is_dir():
+        # Las salidas (xml_out_for) se escriben junto a las entradas: no son productos
+        return sorted(p for p in source.glob("*.xml") if not p.name.endswith((".updated.xml", ".preview.xml")))
+    return [source]
+
+
+@dataclass
+class ProductRun:
+    label: str
+    source_key: str  # clave del producto en el manifiesto de renders
+    xml_out: Path
+    root: ET.Element
+    jobs: list[RenderJob] = field(default_factory=list)
+    t_start: float = 0.0
+    prompt_s: float = 0.0
+
+
+def xml_runs(xml_paths: list[Path], preview: bool = False):
+    for xml_in in xml_paths:
+        root = ET.parse(str(xml_in)).getroot()
+        imgs = gather_images(root)
+        if not imgs:
+            print(f"{xml_in}: no hay nodos <image .../> en el XML. Nada que hacer.")
+            continue
+        ctx = build_context(root)
+        run = ProductRun(
+            label=ctx.get("slug") or xml_in.stem, source_key=str(xml_in.resolve()),
+            xml_out=xml_out_for(xml_in, preview), root=root,
+        )
+        yield run, ctx, imgs
+
+
+def catalog_runs(source: Path, preview: bool = False):
+    """Productos de un directorio de XML o de un feed, leídos en streaming con iter_products."""
+    for path in catalog_files(source):
+        for i, (product, imgs, whole_file) in enumerate(iter_products(path), start=1):
+            if not imgs:
+                continue
+            ctx = build_context(product)
+            label = ctx.get("slug") or f"{path.stem}-{i}"
+            if whole_file:
+                xml_out, source_key = xml_out_for(path, preview), str(path.resolve())
+            else:
+                suffix = "preview" if preview else "updated"
+                xml_out = path.with_name(f"{path.stem}.{suffix}") / f"{slug(label)}.xml"
+                source_key = f"{path.resolve()}#{label}"
+            yield ProductRun(label=label, source_key=source_key, xml_out=xml_out, root=product), ctx, imgs
+
+
+class Finisher:
+    """
+    Cierra cada producto ya renderizado: manifiesto, variantes web (en un pool de
+    procesos, solo para renders sin variantes) y XML actualizado. Los productos
+    esperan a sus variantes sin bloquear el render de los siguientes.
+    """
+
+    def __init__(self, variants: bool = True, workers: int = VARIANT_WORKERS):
+        self.man = load_render_manifest()
+        self.formats = variant_formats() if variants else {}
+        self.pool = (
+            ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) if self.formats else None
+        )
+        self.waiting: list[tuple[ProductRun, dict[str, Future]]] = []
+        self.pending: dict[str, Future] = {}  # codificaciones en curso, compartidas entre productos
+        self.n_products = self.n_imgs = 0
+
+    def add(self, run: ProductRun) -> None:
+        apply_srcs(run.jobs)
+        record_renders(self.man, run.source_key, run.jobs)
+        futs: dict[str, Future] = {}
+        if self.pool is not None:
+            for j in run.jobs:
+                e = self.man["entries"].get(j.key)
+                if e is None or j.preview or j.key in futs:
+                    continue
+                if j.key in self.pending:
+                    futs[j.key] = self.pending[j.key]  # ya la está codificando otro producto
+                    continue
+                if e.get("variants") and all(
+                    (CACHE_DIR / "variants" / v["file"]).exists() for v in e["variants"]
+                ):
+                    continue  # render sin cambios: sus variantes siguen valiendo
+                futs[j.key] = self.pending[j.key] = self.pool.submit(
+                    encode_variants, str(j.out_path), j.key, str(CACHE_DIR / "variants"),
+                    VARIANT_WIDTHS, self.formats,
+                )
+        self.waiting.append((run, futs))
+        self.poll()
+
+    def poll(self, wait: bool = False) -> None:
+        for item in list(self.waiting):
+            run, futs = item
+            if wait or all(f.done() for f in futs.values()):
+                self.waiting.remove(item)
+                self.finish(run, futs)
+
+    def finish(self, run: ProductRun, futs: dict[str, Future]) -> None:
+        for key, fut in futs.items():
+            self.pending.pop(key, None)
+            try:
+                self.man["entries"][key]["variants"] = fut.result()
+            except Exception as e:
+                print(f"  variantes de {key[:12]}: ERROR {e!r}")
+        if self.formats:
+            apply_variants(run.jobs, self.man)
+        run.xml_out.parent.mkdir(parents=True, exist_ok=True)
+        ET.ElementTree(run.root).write(str(run.xml_out), encoding="utf-8", xml_declaration=True)
+
+        self.n_products += 1
+        self.n_imgs += len(run.jobs)
+        line = (
+            f"[{self.n_products}] {run.label}: {len(run.jobs)} imágenes en {time.perf_counter() - run.t_start:.1f}s "
+            f"(prompts {run.prompt_s:.1f}s) -> {run.xml_out}"
+        )
+        png, best = variant_savings(run.jobs, self.man)
+        if png:
+            line += (
+                f"\n    variantes: {len(futs)} renders codificados; PNG {png / 1e6:.2f} MB -> {best / 1e6:.2f} MB "
+                f"(ahorro {(png - best) / 1e6:.2f} MB, {100 * (png - best) / png:.0f}%)"
             )
-            res.images[0].save(out_path)
+        print(line)
+
+    def close(self, cache_max_mb: float | None = CACHE_MAX_MB) -> None:
+        self.poll(wait=True)
+        if self.pool is not None:
+            self.pool.shutdown()
+        removed = evict_renders(self.man, cache_max_mb)
+        if removed:
+            print(f"Caché de renders: {removed} entradas eliminadas por LRU")
+        save_render_manifest(self.man)
+
 
+def run_pipeline(
+    products,
+    renderer: Renderer,
+    use_prompt_cache: bool = True,
+    prompt_group: int = PROMPT_GROUP,
+    preview: bool = False,
+    promote: list[int] | None = None,
+    cache_max_mb: float | None = CACHE_MAX_MB,
+    variants: bool = True,
+) -> None:
+    """
+    Productor/consumidor: un hilo pide los prompts por grupos de `prompt_group`
+    imágenes (0 = el producto entero en una llamada, así el LLM ve todas las
+    imágenes juntas), otro carga el pipeline y este junta los renders que llegan
+    por una cola acotada hasta llenar un lote de `batch_size` o acabar el
+    producto. Cada producto se escribe al terminar su último grupo.
+    """
+    q: queue.Queue = queue.Queue(maxsize=PIPELINE_QUEUE)
+    errors: list[BaseException] = []
+    prompt_cache = PromptCache() if use_prompt_cache else None
 
-        im.el.set("src", str(OUT_DIR / fname))
+    def producer() -> None:
+        try:
+            for run, ctx, imgs in products:
+                run.t_start = time.perf_counter()
+                size = prompt_group if prompt_group > 0 else len(imgs)
+                for i in range(0, len(imgs), size):
+                    chunk = imgs[i:i + size]
+                    # Prompts nuevos implican renders nuevos: la carga se solapa con la llamada al LLM
+                    if prompt_cache is None or prompt_cache.missing(ctx, chunk):
+                        renderer.preload()
+                    t0 = time.perf_counter()
+                    if prompt_cache is not None:
+                        prompts = cached_prompts(ctx, chunk, prompt_cache)
+                    else:
+                        prompts = get_prompts(ctx, chunk)
+                    run.prompt_s += time.perf_counter() - t0
+                    jobs, todo = select_jobs(plan_jobs(chunk, prompts, start=i + 1), preview, promote)
+                    run.jobs.extend(jobs)
+                    if any(not j.out_path.exists() for j in todo):
+                        renderer.preload()
+                    q.put((run, todo))
+                q.put((run, None))  # producto completo
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            q.put(None)
+
+    threading.Thread(target=producer, name="prompts", daemon=True).start()
 
+    finisher = Finisher(variants=variants and not preview)
+    t0 = time.perf_counter()
+    batch: list[RenderJob] = []
+    try:
+        while (item := q.get()) is not None:
+            run, todo = item
+            if todo is not None:
+                # Grupos pequeños no se renderizan sueltos: se espera a tener lotes llenos
+                batch = pending_jobs(batch + todo)
+                full = len(batch) - len(batch) % renderer.batch_size
+                if full:
+                    renderer.render(batch[:full])
+                    batch = batch[full:]
+            else:
+                renderer.render(batch)  # resto del producto
+                batch = []
+                finisher.add(run)  # producto completo
+            finisher.poll()
+    finally:
+        if prompt_cache is not None:
+            prompt_cache.flush()
+    finisher.close(cache_max_mb)
+    renderer.report()
+    if errors:
+        raise errors[0]
+    print(f"Total: {finisher.n_products} productos, {finisher.n_imgs} imágenes en {time.perf_counter() - t0:.1f}s")
 
 
 def main() -> None:
-    if not XML_IN.exists():
-        raise FileNotFoundError(f"No existe {XML_IN.resolve()}")
+    parser = argparse.ArgumentParser(description="Genera las imágenes de una landing de producto con SD.")
+    parser.add_argument("--serve", action="store_true", help="Arranca el daemon de render con el pipeline residente")
+    parser.add_argument("--daemon", type=str, default=DAEMON_URL, help="URL del daemon de render")
+    parser.add_argument("--no-daemon", action="store_true", help="Renderiza siempre en este proceso")
+    parser.add_argument("--xml", type=str, nargs="+", default=[str(XML_IN)], help="XML(s) de producto")
+    parser.add_argument(
+        "--catalog", type=str, default=None,
+        help="Directorio de XML o feed con muchos <product>: se procesa en streaming, producto a producto",
+    )
+    parser.add_argument("--no-prompt-cache", action="store_true", help="Pide siempre los prompts al LLM")
+    parser.add_argument(
+        "--cache-max-mb", type=float, default=CACHE_MAX_MB,
+        help="Tamaño máximo de la caché de renders (se borran primero los no referenciados menos usados)",
+    )
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Imágenes por llamada a Stable Diffusion")
+    parser.add_argument("--procs", type=int, default=PROCS, help="Procesos de render en CPU (1 = en este proceso)")
+    parser.add_argument("--threads", type=int, default=0, help="Hilos de torch por proceso (0 = núcleos / procs)")
+    parser.add_argument(
+        "--compare", type=int, default=0,
+        help="Con --procs > 1: renderiza antes N imágenes en un solo proceso para comparar throughput",
+    )
+    parser.add_argument(
+        "--preview", action="store_true",
+        help=f"Previews rápidos ({PREVIEW_STEPS} pasos, {PREVIEW_SCHEDULER}, resolución / {PREVIEW_SCALE}) en *.preview.xml",
+    )
+    parser.add_argument(
+        "--promote", type=int, nargs="*", default=None, metavar="IDX",
+        help="Renderiza a calidad final (misma semilla) solo las imágenes aprobadas; sin índices, todas",
+    )
+    parser.add_argument(
+        "--no-variants", action="store_true", help="No genera variantes WebP/AVIF/JPEG para srcset",
+    )
+    parser.add_argument(
+        "--prompt-group", type=int, default=PROMPT_GROUP,
+        help="Imágenes por llamada al LLM; cada grupo se renderiza en cuanto tiene prompts (0 = una llamada por producto)",
+    )
+    args = parser.parse_args()
+    if args.preview and args.promote is not None:
+        parser.error("--preview y --promote son excluyentes")
+    if args.serve:
+        serve(args.daemon)
+        return
+    daemon_url = None if args.no_daemon else args.daemon
 
-    tree = ET.parse(str(XML_IN))
-    root = tree.getroot()
+    pipeline_opts = dict(
+        use_prompt_cache=not args.no_prompt_cache, prompt_group=args.prompt_group,
+        preview=args.preview, promote=args.promote, cache_max_mb=args.cache_max_mb,
+        variants=not args.no_variants,
+    )
+    if args.catalog:
+        source = Path(args.catalog)
+        if not source.exists():
+            raise FileNotFoundError(f"No existe {source.resolve()}")
+        if args.procs > 1:
+            print("--catalog renderiza en este proceso; se ignora --procs.")
+        run_pipeline(catalog_runs(source, args.preview), Renderer(daemon_url, args.batch_size), **pipeline_opts)
+        return
+
+    xml_paths = [Path(x) for x in args.xml]
+    for xml_in in xml_paths:
+        if not xml_in.exists():
+            raise FileNotFoundError(f"No existe {xml_in.resolve()}")
 
-    imgs = gather_images(root)
-    if not imgs:
-        print("No hay nodos <image .../> en el XML. Nada que hacer.")
+    if args.procs <= 1:
+        run_pipeline(xml_runs(xml_paths, args.preview), Renderer(daemon_url, args.batch_size), **pipeline_opts)
         return
 
-    ctx = build_context(root)
-    prompts = get_prompts(ctx, imgs)
+    # Render farm: primero todos los prompts, después el reparto entre procesos
+    runs: list[ProductRun] = []
+    to_render: list[RenderJob] = []
+    prompt_cache = None if args.no_prompt_cache else PromptCache()
+    for run, ctx, imgs in xml_runs(xml_paths, args.preview):
+        run.t_start = time.perf_counter()
+        prompts = cached_prompts(ctx, imgs, prompt_cache) if prompt_cache is not None else get_prompts(ctx, imgs)
+        run.prompt_s = time.perf_counter() - run.t_start
+        run.jobs, todo = select_jobs(plan_jobs(imgs, prompts), args.preview, args.promote)
+        runs.append(run)
+        to_render.extend(todo)
+    if prompt_cache is not None:
+        prompt_cache.flush()
 
-    pipe = load_sd()
-    render_all(pipe, imgs, prompts)
+    if not runs:
+        return
+
+    if args.compare:
+        ref = baseline_ips(to_render, args.compare)
+    agg = render_farm(to_render, args.procs, args.threads or None)
+    if args.compare and ref:
+        print(f"Speedup frente a 1 proceso: {agg / ref:.2f}x ({ref:.3f} -> {agg:.3f} img/s)")
 
-    tree.write(str(XML_OUT), encoding="utf-8", xml_declaration=True)
-    print(f"OK -> {XML_OUT} (imágenes en {OUT_DIR}/)")
+    finisher = Finisher(variants=not args.no_variants and not args.preview)
+    for run in runs:
+        finisher.add(run)
+    finisher.close(args.cache_max_mb)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,443 @@
+"""
+Benchmark offline de Imágenes con IA.py: sustituye Stable Diffusion por un
+pipeline diminuto con pesos aleatorios y Ollama por un /api/generate local que
+devuelve JSON fijo. Genera XML de producto sintéticos y mide cada etapa
+(parseo del XML, prompts, carga del modelo, render, escritura del XML) y el RSS
+máximo, para comparar tamaños de lote y procesos sin red ni GPU. Cada modo corre
+en su propio proceso; el modo pipeline usa run_pipeline (etapas solapadas).
+
+    python benchmark.py --products 3 --images 8 --batch-size 1 4 --procs 1 2
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from dataclasses import asdict, dataclass, replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import List
+import xml.etree.ElementTree as ET
+
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+GENERATOR = SCRIPT_DIR / "Imágenes con IA.py"
+
+SECTIONS = ("hero", "problem", "solution", "keyFeatures", "targetAudience", "useCases", "benefits", "finalCTA")
+
+
+# ---------------------------------------------------------------------------
+# Ollama falso
+# ---------------------------------------------------------------------------
+
+class MockOllama:
+    """
+    /api/generate que responde con un prompt por cada "id" de la petición. El
+    prompt incluye el slug del producto y el alt de la imagen: con uno fijo por
+    id, todos los productos tras el primero saldrían de la caché de renders.
+    """
+
+    def __init__(self, latency: float = 0.2, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api/generate"
+
+    def __enter__(self) -> "MockOllama":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_POST(self) -> None:
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+                with mock.lock:
+                    mock.requests += 1
+                time.sleep(mock.latency)
+                text = payload.get("prompt", "")
+                # Lista de peticiones de get_prompts: [{"id", "section", "alt", "src"}, ...]
+                reqs = re.search(r"Image requests:\s*(\[.*?\])\s*\n\n", text, re.S)
+                reqs = json.loads(reqs.group(1)) if reqs else []
+                slug = re.search(r'"slug":\s*"([^"]*)"', text)
+                slug = slug.group(1) if slug else "product"
+                images = [
+                    {"id": r["id"], "prompt": f"minimal premium {slug} scene, {r['alt']}, soft light",
+                     "negative_prompt": "text, logo, watermark"}
+                    for r in reqs
+                ]
+                body = json.dumps({"response": json.dumps({"images": images}), "done": True}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+# ---------------------------------------------------------------------------
+# Pipeline diminuto y XML sintéticos
+# ---------------------------------------------------------------------------
+
+def make_tiny_pipeline(out_dir: Path, seed: int = 0) -> Path:
+    """
+    Guarda en `out_dir` un StableDiffusionPipeline con la arquitectura de SD 1.5
+    a escala mínima y pesos aleatorios. El VAE mantiene el factor 8 de reducción
+    para que las latentes tengan la misma forma que con el modelo real.
+    """
+    import torch
+    from diffusers import AutoencoderKL, DDIMScheduler, StableDiffusionPipeline, UNet2DConditionModel
+    from transformers import CLIPTextConfig, CLIPTextModel, CLIPTokenizer
+
+    torch.manual_seed(seed)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=1,
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        cross_attention_dim=32,
+    )
+    vae = AutoencoderKL(
+        block_out_channels=(32, 32, 32, 32),
+        in_channels=3,
+        out_channels=3,
+        down_block_types=("DownEncoderBlock2D",) * 4,
+        up_block_types=("UpDecoderBlock2D",) * 4,
+        latent_channels=4,
+    )
+    text_encoder = CLIPTextModel(CLIPTextConfig(
+        bos_token_id=0, eos_token_id=1, pad_token_id=1, hidden_size=32, intermediate_size=37,
+        num_attention_heads=4, num_hidden_layers=2, vocab_size=1000, max_position_embeddings=77,
+    ))
+
+    # Vocabulario mínimo: todo lo que no esté en él se tokeniza como <|endoftext|>
+    tok_dir = out_dir / "_tokenizer"
+    tok_dir.mkdir(parents=True, exist_ok=True)
+    vocab = {"<|startoftext|>": 0, "<|endoftext|>": 1}
+    for i, ch in enumerate("abcdefghijklmnopqrstuvwxyz", start=2):
+        vocab[f"{ch}</w>"] = i
+    (tok_dir / "vocab.json").write_text(json.dumps(vocab), encoding="utf-8")
+    (tok_dir / "merges.txt").write_text("#version: 0.2\n", encoding="utf-8")
+    tokenizer = CLIPTokenizer(str(tok_dir / "vocab.json"), str(tok_dir / "merges.txt"), model_max_length=77)
+
+    scheduler = DDIMScheduler(
+        beta_start=0.00085, beta_end=0.012, beta_schedule="scaled_linear",
+        clip_sample=False, set_alpha_to_one=False, steps_offset=1,
+    )
+    pipe = StableDiffusionPipeline(
+        vae=vae, text_encoder=text_encoder, tokenizer=tokenizer, unet=unet, scheduler=scheduler,
+        safety_checker=None, feature_extractor=None, requires_safety_checker=False,
+    )
+    pipe.save_pretrained(str(out_dir))
+    shutil.rmtree(tok_dir)
+    return out_dir
+
+
+def make_products(xml_dir: Path, products: int, images: int) -> List[Path]:
+    """XML de producto con `images` imágenes repartidas por las secciones."""
+    xml_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for p in range(1, products + 1):
+        root = ET.Element("product")
+        meta = ET.SubElement(root, "meta")
+        ET.SubElement(meta, "slug").text = f"producto-{p}"
+        ET.SubElement(meta, "title").text = f"Producto {p}"
+        ET.SubElement(meta, "category").text = "saas"
+        sections = {name: ET.SubElement(root, name) for name in SECTIONS}
+        ET.SubElement(sections["hero"], "valueProposition").text = f"Propuesta de valor {p}"
+        for i in range(images):
+            name = SECTIONS[i % len(SECTIONS)]
+            ET.SubElement(sections[name], "image", {"src": f"{name}-{i}.png", "alt": f"{name} {i}"})
+        path = xml_dir / f"producto_{p:03d}.xml"
+        ET.ElementTree(root).write(str(path), encoding="utf-8", xml_declaration=True)
+        paths.append(path)
+    return paths
+
+
+# ---------------------------------------------------------------------------
+# Ejecución
+# ---------------------------------------------------------------------------
+
+def load_generator(work: Path):
+    # Copia importable por nombre: los procesos "spawn" del render farm y del pool
+    # de variantes tienen que poder volver a importar el módulo
+    shutil.copy(GENERATOR, work / "imagenes_ia.py")
+    sys.path.insert(0, str(work))
+    return importlib.import_module("imagenes_ia")
+
+
+def max_rss_mb(who: int) -> float:
+    # ru_maxrss está en KB en Linux (y en bytes en macOS)
+    rss = resource.getrusage(who).ru_maxrss
+    return rss / 1e6 if sys.platform == "darwin" else rss / 1024
+
+
+@dataclass
+class Result:
+    mode: str
+    images: int
+    rendered: int  # imágenes realmente renderizadas (sin aciertos de la caché)
+    parse_s: float | None  # None: la etapa va dentro del pipeline solapado y no se mide aparte
+    prompts_s: float
+    load_s: float
+    render_s: float
+    write_s: float | None
+    total_s: float
+    images_per_s: float
+    llm_requests: int
+    peak_rss_mb: float
+    peak_rss_children_mb: float
+
+
+def sized_plan_jobs(gen, width: int, height: int, steps: int) -> None:
+    """Sustituye gen.plan_jobs para que todos los modos (también run_pipeline) rendericen al tamaño pedido."""
+    plan = gen.plan_jobs
+
+    def plan_jobs(imgs, prompts, cache_dir=gen.CACHE_DIR, start=1):
+        jobs = []
+        for j in plan(imgs, prompts, cache_dir, start):
+            j = replace(j, width=width, height=height, steps=steps)
+            j.out_path = cache_dir / f"{j.key}.png"
+            jobs.append(j)
+        return jobs
+
+    gen.plan_jobs = plan_jobs
+
+
+def cold_caches(gen) -> None:
+    # Caches frías en cada pasada: prompts, renders y manifiesto
+    Path(gen.PROMPT_CACHE).unlink(missing_ok=True)
+    shutil.rmtree(gen.OUT_DIR, ignore_errors=True)
+
+
+def bench_once(gen, xml_paths: List[Path], batch_size: int, procs: int, variants: bool) -> Result:
+    """Etapas una detrás de otra: parseo, prompts, carga, render y escritura."""
+    cold_caches(gen)
+    t_total = time.perf_counter()
+
+    t0 = time.perf_counter()
+    parsed = []
+    for path in xml_paths:
+        root = ET.parse(str(path)).getroot()
+        parsed.append((path, root, gen.gather_images(root), gen.build_context(root)))
+    parse_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    runs = []
+    for path, root, imgs, ctx in parsed:
+        run = gen.ProductRun(
+            label=ctx["slug"], source_key=str(path.resolve()), xml_out=gen.xml_out_for(path), root=root,
+            jobs=gen.plan_jobs(imgs, gen.cached_prompts(ctx, imgs)),
+        )
+        runs.append(run)
+    prompts_s = time.perf_counter() - t0
+    all_jobs = [j for run in runs for j in run.jobs]
+    rendered = len(gen.pending_jobs(all_jobs))
+
+    load_s = 0.0
+    t0 = time.perf_counter()
+    if procs > 1:
+        # Cada proceso carga su copia del modelo: la carga va dentro del tiempo de render
+        gen.render_farm(all_jobs, procs)
+    else:
+        t_load = time.perf_counter()
+        pipe, _, _ = gen.cold_load()
+        load_s = time.perf_counter() - t_load
+        gen.render_jobs(pipe, all_jobs, batch_size=batch_size)
+        del pipe
+    render_s = time.perf_counter() - t0 - load_s
+
+    t0 = time.perf_counter()
+    finisher = gen.Finisher(variants=variants)
+    for run in runs:
+        run.t_start = time.perf_counter()
+        finisher.add(run)
+    finisher.close()
+    write_s = time.perf_counter() - t0
+
+    return Result(
+        mode=f"procs={procs}" if procs > 1 else f"batch={batch_size}",
+        images=len(all_jobs),
+        rendered=rendered,
+        parse_s=round(parse_s, 4),
+        prompts_s=round(prompts_s, 3),
+        load_s=round(load_s, 3),
+        render_s=round(render_s, 3),
+        write_s=round(write_s, 3),
+        total_s=round(time.perf_counter() - t_total, 3),
+        images_per_s=round(rendered / render_s, 3) if render_s else 0.0,
+        llm_requests=0,
+        peak_rss_mb=round(max_rss_mb(resource.RUSAGE_SELF), 1),
+        peak_rss_children_mb=round(max_rss_mb(resource.RUSAGE_CHILDREN), 1),
+    )
+
+
+def bench_pipeline(gen, xml_paths: List[Path], batch_size: int, prompt_group: int, variants: bool) -> Result:
+    """
+    El camino real del CLI: run_pipeline con prompts, carga y render solapados.
+    Las etapas se solapan, así que prompts/carga/render son tiempo ocupado de cada
+    una y lo comparable con los demás modos es total_s.
+    """
+    cold_caches(gen)
+    runs = []
+
+    def products():
+        for run, ctx, imgs in gen.xml_runs(xml_paths):
+            runs.append(run)
+            yield run, ctx, imgs
+
+    renderer = gen.Renderer(None, batch_size)
+    t0 = time.perf_counter()
+    gen.run_pipeline(products(), renderer, prompt_group=prompt_group, variants=variants)
+    total_s = time.perf_counter() - t0
+    render_s = renderer.cold.get("render_s", 0.0)
+    rendered = len(list(gen.CACHE_DIR.glob("*.png")))
+    return Result(
+        mode=f"pipeline={batch_size}",
+        images=sum(len(run.jobs) for run in runs),
+        rendered=rendered,
+        parse_s=None,
+        prompts_s=round(sum(run.prompt_s for run in runs), 3),
+        load_s=round(renderer.cold.get("import_s", 0.0) + renderer.cold.get("load_s", 0.0), 3),
+        render_s=round(render_s, 3),
+        write_s=None,
+        total_s=round(total_s, 3),
+        images_per_s=round(rendered / render_s, 3) if render_s else 0.0,
+        llm_requests=0,
+        peak_rss_mb=round(max_rss_mb(resource.RUSAGE_SELF), 1),
+        peak_rss_children_mb=round(max_rss_mb(resource.RUSAGE_CHILDREN), 1),
+    )
+
+
+def run_mode(spec: dict, out) -> None:
+    """
+    Un modo en su propio proceso: ru_maxrss es el máximo de toda la vida del
+    proceso, así que en un proceso compartido cada modo heredaría el pico del anterior.
+    """
+    try:
+        work = Path(spec["work"])
+        gen = load_generator(work)
+        gen.MODEL_ID = spec["model"]
+        gen.OLLAMA_URL = spec["ollama_url"]
+        sized_plan_jobs(gen, spec["width"], spec["height"], spec["steps"])
+        os.chdir(work)  # cachés y salidas relativas del script quedan en el temporal
+        xml_paths = [Path(x) for x in spec["xml"]]
+        if spec["kind"] == "pipeline":
+            res = bench_pipeline(gen, xml_paths, spec["batch_size"], spec["prompt_group"], spec["variants"])
+        else:
+            res = bench_once(gen, xml_paths, spec["batch_size"], spec["procs"], spec["variants"])
+        out.put(asdict(res))
+    except BaseException:
+        out.put({"error": traceback.format_exc()})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark offline de Imágenes con IA.py con un modelo diminuto.")
+    parser.add_argument("--products", type=int, default=2, help="XML de producto sintéticos")
+    parser.add_argument("--images", type=int, default=6, help="Imágenes por producto")
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[1, 4], help="Tamaños de lote a probar (1 proceso)")
+    parser.add_argument("--procs", type=int, nargs="+", default=[], help="Procesos del render farm a probar")
+    parser.add_argument(
+        "--no-pipeline", action="store_true",
+        help="No prueba run_pipeline (prompts, carga y render solapados) con el primer tamaño de lote",
+    )
+    parser.add_argument(
+        "--prompt-group", type=int, default=0, help="Imágenes por llamada al LLM en el modo pipeline (0 = todo el producto)",
+    )
+    parser.add_argument("--width", type=int, default=256, help="Ancho de render (múltiplo de 8)")
+    parser.add_argument("--height", type=int, default=144, help="Alto de render (múltiplo de 8)")
+    parser.add_argument("--steps", type=int, default=4, help="Pasos de inferencia")
+    parser.add_argument("--latency", type=float, default=0.2, help="Segundos por respuesta del Ollama falso")
+    parser.add_argument("--variants", action="store_true", help="Incluye las variantes web en la escritura")
+    parser.add_argument("--json", type=str, default="", help="Guarda los resultados en este fichero JSON")
+    args = parser.parse_args()
+
+    results: List[Result] = []
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(prefix="imggen-bench-") as tmp, MockOllama(args.latency) as mock:
+        work = Path(tmp)
+        model_dir = make_tiny_pipeline(work / "tiny-sd")
+        os.environ["SD_MODEL_ID"] = str(model_dir)  # lo heredan los procesos de cada modo
+        xml_paths = make_products(work / "xml", args.products, args.images)
+        print(
+            f"{args.products} productos × {args.images} imágenes, {args.width}x{args.height}, "
+            f"{args.steps} pasos  |  mock: {mock.url}"
+        )
+
+        base = {
+            "work": str(work), "model": str(model_dir), "ollama_url": mock.url, "xml": [str(p) for p in xml_paths],
+            "width": args.width, "height": args.height, "steps": args.steps, "variants": args.variants,
+            "prompt_group": args.prompt_group,
+        }
+        modes = [dict(base, kind="once", batch_size=b, procs=1) for b in args.batch_size]
+        modes += [dict(base, kind="once", batch_size=1, procs=p) for p in args.procs if p > 1]
+        if not args.no_pipeline:
+            modes.append(dict(base, kind="pipeline", batch_size=args.batch_size[0], procs=1))
+
+        for spec in modes:
+            req0 = mock.requests
+            out = ctx.Queue()
+            proc = ctx.Process(target=run_mode, args=(spec, out))
+            proc.start()
+            data = out.get()
+            proc.join()
+            if "error" in data:
+                raise RuntimeError(f"Modo {spec['kind']} (lote {spec['batch_size']}, procs {spec['procs']}) falló:\n"
+                                   f"{data['error']}")
+            res = Result(**dict(data, llm_requests=mock.requests - req0))
+            results.append(res)
+            parse = f"{res.parse_s:.3f}s" if res.parse_s is not None else "-"
+            write = f"{res.write_s:.2f}s" if res.write_s is not None else "-"
+            print(
+                f"{res.mode:<11} {res.images:>4} img ({res.rendered} render)  parse={parse}  "
+                f"prompts={res.prompts_s:.2f}s  carga={res.load_s:.2f}s  "
+                f"render={res.render_s:.2f}s ({res.images_per_s:.2f} img/s)  xml={write}  "
+                f"total={res.total_s:.2f}s  llm={res.llm_requests}  "
+                f"rss={res.peak_rss_mb:.0f}MB hijos={res.peak_rss_children_mb:.0f}MB"
+            )
+
+    if args.json:
+        Path(args.json).write_text(
+            json.dumps(
+                {"products": args.products, "images": args.images, "width": args.width, "height": args.height,
+                 "steps": args.steps, "results": [asdict(r) for r in results]},
+                ensure_ascii=False,
+                indent=2,
+            ),
+            encoding="utf-8",
+        )
+        print(f"Resultados en {args.json}")
+
+
+if __name__ == "__main__":
+    main()